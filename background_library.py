@@ -0,0 +1,313 @@
+from bisect import bisect_right
+import hashlib
+import json
+import os
+from pathlib import Path
+import random
+from random import randrange
+import subprocess
+import time
+from typing import Tuple
+from configuration import Configuration
+from ffmpeg_renderer import crop_and_scale_filter
+
+config = Configuration()
+
+POSSIBLE_FILE_ENDINGS = (".mp4", ".webm", ".mkv", ".ogv", ".mpeg", ".avi", ".mov")
+
+
+class BackgroundVideo:
+    def __init__(
+        self,
+        filename: str,
+        credit: str,
+        duration: float,
+        width: int,
+        height: int,
+        fps: float,
+        codec: str,
+        has_audio: bool,
+        mtime: float,
+        size: int,
+        keyframes: list[float] | None = None,
+    ) -> None:
+        self.filename = filename
+        self.credit = credit
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.codec = codec
+        self.has_audio = has_audio
+        self.mtime = mtime
+        self.size = size
+        self.keyframes = keyframes
+
+
+def parse_frame_rate(rate: str) -> float:
+    numerator, _, denominator = rate.partition("/")
+    if denominator == "" or float(denominator) == 0:
+        return float(numerator)
+    return float(numerator) / float(denominator)
+
+
+def probe_keyframes(path: Path) -> list[float]:
+    # reading packet flags is much faster than decoding the keyframes
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time,flags",
+            "-of",
+            "csv=print_section=0",
+            str(path),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    try:
+        result.check_returncode()
+    except subprocess.CalledProcessError:
+        raise Exception(f"Could not read keyframes of background video {path}")
+
+    keyframes: list[float] = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(round(float(pts_time), 3))
+    keyframes.sort()
+    return keyframes
+
+
+def probe_video(path: Path) -> BackgroundVideo:
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-print_format",
+            "json",
+            "-show_format",
+            "-show_streams",
+            str(path),
+        ],
+        capture_output=True,
+    )
+    try:
+        result.check_returncode()
+    except subprocess.CalledProcessError:
+        raise Exception(f"Could not probe background video {path}")
+
+    probe = json.loads(result.stdout)
+    video_stream = next(
+        stream for stream in probe["streams"] if stream["codec_type"] == "video"
+    )
+    has_audio = any(stream["codec_type"] == "audio" for stream in probe["streams"])
+    stat = path.stat()
+
+    return BackgroundVideo(
+        str(path),
+        path.parent.name,
+        float(probe["format"]["duration"]),
+        int(video_stream["width"]),
+        int(video_stream["height"]),
+        parse_frame_rate(video_stream["avg_frame_rate"]),
+        video_stream["codec_name"],
+        has_audio,
+        stat.st_mtime,
+        stat.st_size,
+        probe_keyframes(path),
+    )
+
+
+def proxy_filename(video: BackgroundVideo, resolution: Tuple[int, int]) -> str:
+    # the hash of the whole source path keeps clip.mp4 and clip.webm, or clips
+    # of the same name in different folders, from sharing one proxy
+    source_hash = hashlib.sha1(video.filename.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(
+        config.background_proxies_dir,
+        f"{resolution[0]}x{resolution[1]}",
+        video.credit,
+        f"{Path(video.filename).stem}-{source_hash}.mp4",
+    )
+
+
+def has_up_to_date_proxy(video: BackgroundVideo, resolution: Tuple[int, int]) -> bool:
+    proxy = proxy_filename(video, resolution)
+    return os.path.exists(proxy) and video.mtime <= os.path.getmtime(proxy)
+
+
+def create_proxy(video: BackgroundVideo, resolution: Tuple[int, int]):
+    proxy = proxy_filename(video, resolution)
+    os.makedirs(os.path.dirname(proxy), exist_ok=True)
+    tmp_file = proxy + ".tmp.mp4"
+
+    # short GOPs so that any start time can be reached without decoding much
+    gop_size = round(proxy_gop_duration() * config.video_fps)
+    command = [
+        "ffmpeg",
+        "-y",
+        "-i",
+        video.filename,
+        "-vf",
+        crop_and_scale_filter(resolution, config.video_fps),
+        "-c:v",
+        "libx264",
+        "-preset",
+        config.write_video_preset,
+        "-crf",
+        "18",
+        "-g",
+        str(gop_size),
+        "-keyint_min",
+        str(gop_size),
+        "-sc_threshold",
+        "0",
+        "-pix_fmt",
+        "yuv420p",
+        "-threads",
+        str(config.num_threads),
+    ]
+    command += ["-c:a", "aac"] if video.has_audio else ["-an"]
+    command.append(tmp_file)
+
+    print(f"creating {resolution[0]}x{resolution[1]} proxy of {video.filename}")
+    result = subprocess.run(command)
+    try:
+        result.check_returncode()
+    except subprocess.CalledProcessError:
+        raise Exception(f"Could not create proxy of {video.filename}")
+    os.replace(tmp_file, proxy)
+
+
+def proxy_gop_duration() -> float:
+    gop_size = max(1, round(config.video_fps * config.background_proxy_gop_seconds))
+    return gop_size / config.video_fps
+
+
+def choose_start_time(video: BackgroundVideo, min_length: float, proxy: bool) -> float:
+    """Random start time for a window of min_length that lies on a keyframe,
+    so the reader can seek straight to it instead of decoding up to it."""
+    latest_start = max(0, video.duration - min_length)
+
+    if proxy:
+        gop_duration = proxy_gop_duration()
+        return randrange(int(latest_start // gop_duration) + 1) * gop_duration
+
+    if video.keyframes == None or len(video.keyframes) == 0:
+        return random.random() * latest_start
+
+    num_candidates = bisect_right(video.keyframes, latest_start)
+    if num_candidates == 0:
+        return random.random() * latest_start
+    return video.keyframes[randrange(num_candidates)]
+
+
+def prepare_background_proxies(resolutions: list[Tuple[int, int]]):
+    library = get_background_library(refresh=True)
+    for video in library.videos.values():
+        for resolution in resolutions:
+            if not has_up_to_date_proxy(video, resolution):
+                create_proxy(video, resolution)
+
+
+class BackgroundLibrary:
+    """On-disk index of the background videos so that selecting one does not
+    need to open every file. Only new or changed files are probed."""
+
+    def __init__(self, directory: str, index_file: str) -> None:
+        self.directory = directory
+        self.index_file = index_file
+        self.videos: dict[str, BackgroundVideo] = {}
+        self.refreshed: float | None = None
+
+        if os.path.exists(index_file):
+            with open(index_file, "r") as file:
+                for entry in json.loads(file.read()):
+                    video = BackgroundVideo(**entry)
+                    self.videos[video.filename] = video
+
+    def refresh(self):
+        found: set[str] = set()
+        changed = False
+
+        for path in Path(self.directory).glob("**/*"):
+            if path.suffix not in POSSIBLE_FILE_ENDINGS:
+                continue
+            path = path.resolve()
+            filename = str(path)
+            found.add(filename)
+
+            stat = path.stat()
+            known = self.videos.get(filename)
+            if (
+                known != None
+                and known.mtime == stat.st_mtime
+                and known.size == stat.st_size
+                and known.keyframes != None
+            ):
+                continue
+
+            print(f"indexing background video {filename}")
+            try:
+                self.videos[filename] = probe_video(path)
+            except Exception as e:
+                print(e)
+                continue
+            changed = True
+
+        for filename in list(self.videos.keys()):
+            if filename not in found:
+                print(f"removing {filename} from background video index")
+                del self.videos[filename]
+                changed = True
+
+        if changed:
+            self.save()
+        self.refreshed = time.monotonic()
+
+    def is_stale(self, ttl: float) -> bool:
+        return self.refreshed == None or ttl <= time.monotonic() - self.refreshed
+
+    def save(self):
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w") as file:
+            file.write(
+                json.dumps([video.__dict__ for video in self.videos.values()], indent=4)
+            )
+        os.replace(tmp_file, self.index_file)
+
+    def videos_with_min_length(self, min_length: float) -> list[BackgroundVideo]:
+        return [video for video in self.videos.values() if min_length <= video.duration]
+
+    def choose(self, min_length: float) -> BackgroundVideo | None:
+        candidates = self.videos_with_min_length(min_length)
+        if len(candidates) == 0:
+            return None
+        return random.choice(candidates)
+
+
+__library: BackgroundLibrary | None = None
+
+
+def get_background_library(refresh: bool = False) -> BackgroundLibrary:
+    """The directory is only searched again for changed files when refresh is
+    set or the last search is older than background_index_ttl seconds."""
+    global __library
+    if __library == None:
+        __library = BackgroundLibrary(
+            config.background_videos_dir, config.background_index_file
+        )
+    if refresh or __library.is_stale(config.background_index_ttl):
+        __library.refresh()
+    return __library
+
+
+if __name__ == "__main__":
+    prepare_background_proxies(
+        [tuple(resolution) for resolution in config.background_proxy_resolutions]  # type: ignore
+    )
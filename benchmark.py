@@ -0,0 +1,431 @@
+"""Offline end-to-end benchmark of the story and comment pipelines.
+
+TTS, the LLM, forced alignment and Reddit are replaced by local stand-ins of
+realistic size, everything else runs the real code. The results are written
+as json so that runs of different commits can be compared.
+
+    python benchmark.py --lengths 1 5 --output benchmark_results/
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+from typing import Tuple
+from PIL import Image
+
+import caption_cache
+import story_based_video
+import thumbnail_renderer
+import thumbnail_with_text
+import video_generator
+from caption_cache import CaptionCache
+from comment_based_video import generate_comment_narration, generate_comments_clip
+from configuration import Configuration
+from instrumentation import process_peak_rss_bytes, span
+from openai_interface import OpenAiInterface
+from reddit_requests import Comment, Post
+from render_timeline import Timeline
+from story_based_video import generate_story_clip, generate_story_narration
+from thumbnail_with_text import generate_thumbnail_with_text
+from video_utils import CHARS_PER_SECOND, BackgroundSelection
+
+config = Configuration()
+
+WORDS = (
+    "the my she he they we was were had said told never always because after "
+    "before then when mother father sister brother friend boss neighbor house "
+    "car work school wedding party money dinner phone message door kitchen "
+    "angry happy surprised quietly finally suddenly honestly really actually "
+    "decided wanted asked called walked refused laughed cried promised left"
+).split()
+
+
+def fake_sentences(num_chars: int, rng: random.Random) -> str:
+    sentences: list[str] = []
+    length = 0
+    while length < num_chars:
+        words = [rng.choice(WORDS) for _ in range(rng.randrange(6, 18))]
+        sentence = " ".join(words).capitalize() + rng.choice([".", ".", ".", "!", "?"])
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return " ".join(sentences)
+
+
+def fixture_post(post_id: str, selftext: str) -> Post:
+    return Post(
+        {
+            "kind": "t3",
+            "data": {
+                "subreddit": "AmItheAsshole",
+                "title": "AITA for benchmarking the video generator with a made up story?",
+                "author": "benchmark",
+                "selftext": selftext,
+                "id": post_id,
+                "gilded": 0,
+                "ups": 12345,
+                "downs": 0,
+                "score": 12345,
+                "url": f"https://www.reddit.com/{post_id}",
+                "num_comments": 678,
+                "over_18": False,
+                # an empty url makes the thumbnail fall back to the default icon
+                "sr_detail": {"icon_img": ""},
+            },
+        }
+    )
+
+
+def fixture_story_post(minutes: float, rng: random.Random) -> Post:
+    text = fake_sentences(int(minutes * 60 * CHARS_PER_SECOND), rng)
+    return fixture_post(f"benchstory{minutes:g}m", text)
+
+
+def fixture_comment_post(minutes: float, rng: random.Random) -> Post:
+    post = fixture_post(f"benchcomment{minutes:g}m", "")
+    num_chars = int(minutes * 60 * CHARS_PER_SECOND)
+    index = 0
+    # get_good_comments always drops the last comment
+    while num_chars > -500:
+        body = fake_sentences(rng.randrange(100, 600), rng)
+        num_chars -= len(body)
+        post.comments.append(
+            Comment(
+                {
+                    "kind": "t1",
+                    "data": {
+                        "author": f"commenter{index}",
+                        "body": body,
+                        "replies": "",
+                        "ups": 1000,
+                        "downs": 0,
+                        "score": 1000,
+                        "gilded": 0,
+                        "id": f"c{index}",
+                    },
+                }
+            )
+        )
+        index += 1
+    return post
+
+
+def run_ffmpeg(arguments: list[str]):
+    result = subprocess.run(["ffmpeg", "-y", "-v", "error"] + arguments)
+    try:
+        result.check_returncode()
+    except subprocess.CalledProcessError:
+        raise Exception(f"ffmpeg failed: {arguments}")
+
+
+def stub_generate_mp3(self, text: str, filepath: str):
+    # a tone as long as the real narration of the text would be
+    duration = max(1, len(text) / CHARS_PER_SECOND)
+    with span("tts"):
+        run_ffmpeg(
+            [
+                "-f",
+                "lavfi",
+                "-i",
+                f"sine=frequency=220:duration={duration:.2f}",
+                filepath,
+            ]
+        )
+
+
+def stub_generate_text(self, *args, **kwargs) -> str:
+    return "This is what happened when somebody benchmarked the video generator."
+
+
+def stub_align_audio_and_text(audiofile: str, textfile: str, language: str):
+    # words spread evenly over the audio, written like mfa would write them
+    with open(textfile, "r", encoding="utf-8") as file:
+        words = file.read().split()
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "csv=p=0",
+            audiofile,
+        ],
+        capture_output=True,
+        text=True,
+    )
+    duration = float(result.stdout.strip())
+    word_duration = duration / len(words)
+
+    lines = [
+        'File type = "ooTextFile"',
+        'Object class = "TextGrid"',
+        "",
+        "xmin = 0",
+        f"xmax = {duration}",
+        "tiers? <exists>",
+        "size = 1",
+        "item []:",
+        "    item [1]:",
+        '        class = "IntervalTier"',
+        '        name = "words"',
+        "        xmin = 0",
+        f"        xmax = {duration}",
+        f"        intervals: size = {len(words)}",
+    ]
+    for index, word in enumerate(words):
+        lines += [
+            f"        intervals [{index + 1}]:",
+            f"            xmin = {index * word_duration}",
+            f"            xmax = {(index + 1) * word_duration}",
+            f'            text = "{word}"',
+        ]
+    with open(audiofile[: audiofile.rindex(".")] + ".TextGrid", "w") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+def install_stubs(workdir: str):
+    OpenAiInterface.generate_mp3 = stub_generate_mp3  # type: ignore
+    OpenAiInterface.generate_text_without_context = stub_generate_text  # type: ignore
+    OpenAiInterface.generate_text_with_context = stub_generate_text  # type: ignore
+    story_based_video.align_audio_and_text = stub_align_audio_and_text
+
+    # every run has to rasterise its captions, nothing comes from disk
+    caption_cache.caption_cache = CaptionCache(config.caption_cache_size, None)
+
+    icons = {}
+    for name, color in [
+        ("reddit_logo", "#FF4500"),
+        ("upvote", "#000000"),
+        ("comments", "#000000"),
+    ]:
+        icons[name] = os.path.join(workdir, f"{name}.png")
+        Image.new("RGBA", (128, 128), color).save(icons[name])
+    for module in [thumbnail_with_text, thumbnail_renderer]:
+        module.config.thumbnail_default_subreddit_icon = icons["reddit_logo"]
+        module.config.thumbnail_upvotes_icon = icons["upvote"]
+        module.config.thumbnail_comments_icon = icons["comments"]
+
+
+def generate_background_video(workdir: str, duration: float, size: str) -> str:
+    filename = os.path.join(workdir, f"background-{size}-{int(duration)}.mp4")
+    if not os.path.exists(filename):
+        print(f"generating {duration:.0f}s background video")
+        run_ffmpeg(
+            [
+                "-f",
+                "lavfi",
+                "-i",
+                f"testsrc2=size={size}:rate=30",
+                "-f",
+                "lavfi",
+                "-i",
+                "anoisesrc=amplitude=0.1",
+                "-t",
+                f"{duration:.0f}",
+                "-c:v",
+                "libx264",
+                "-preset",
+                "ultrafast",
+                "-g",
+                "250",
+                "-c:a",
+                "aac",
+                filename,
+            ]
+        )
+    return filename
+
+
+def remove_tmp_files(post: Post):
+    for f in os.listdir("tmp/"):
+        if f.startswith(post.post_id):
+            os.remove(f"tmp/{f}")
+
+
+def run_benchmark(
+    kind: str,
+    minutes: float,
+    resolution: Tuple[int, int],
+    background_file: str,
+    workdir: str,
+) -> dict:
+    rng = random.Random(f"{kind}{minutes}")
+    if kind == "story":
+        post = fixture_story_post(minutes, rng)
+    else:
+        post = fixture_comment_post(minutes, rng)
+    remove_tmp_files(post)
+
+    output = os.path.join(
+        workdir, f"{post.post_id}-{resolution[0]}x{resolution[1]}.mp4"
+    )
+    timeline = Timeline(resolution)
+
+    print(f"benchmarking {kind} of {minutes} minutes at {resolution}")
+    with span("benchmark") as root:
+        with span(f"{kind}_clip"):
+            if kind == "story":
+                narration = generate_story_narration(post, "english", True, True)
+                video = generate_story_clip(post, resolution, narration, timeline)
+            else:
+                narration = generate_comment_narration(post, True, True)
+                video = generate_comments_clip(post, resolution, narration, timeline)
+
+        background = BackgroundSelection(
+            background_file, "benchmark", 0, video.duration, True
+        )
+        with span("render"):
+            video_generator.render_videos(
+                [video], background, [timeline], post, [output]
+            )
+
+        with span("thumbnail"):
+            generate_thumbnail_with_text(post, resolution).save(output + ".jpg")
+
+    remove_tmp_files(post)
+
+    render_time = root.children["render"].wall_time
+    return {
+        "kind": kind,
+        "minutes": minutes,
+        "resolution": list(resolution),
+        "render_backend": video_generator.config.render_backend,
+        "caption_renderer": config.caption_renderer,
+        "thumbnail_renderer": thumbnail_with_text.config.thumbnail_renderer,
+        "duration": video.duration,
+        "frames_per_second": video.duration * config.video_fps / render_time,
+        "seconds_per_minute_of_output": root.wall_time / (video.duration / 60),
+        "process_peak_rss": process_peak_rss_bytes(),
+        "stages": root.flatten(),
+    }
+
+
+def current_commit() -> str | None:
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
+
+
+def run_benchmark_in_subprocess(
+    kind: str,
+    minutes: float,
+    resolution: str,
+    background_file: str,
+    args: argparse.Namespace,
+) -> dict:
+    """Runs a single configuration in a new process, so that the peak memory
+    it reports is its own and not that of the heaviest run before it."""
+    result_file = os.path.join(args.workdir, "run.json")
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--run-one",
+        kind,
+        str(minutes),
+        resolution,
+        "--background-file",
+        background_file,
+        "--workdir",
+        args.workdir,
+        "--result-file",
+        result_file,
+    ]
+    if args.backend != None:
+        command += ["--backend", args.backend]
+    result = subprocess.run(command)
+    try:
+        result.check_returncode()
+    except subprocess.CalledProcessError:
+        raise Exception(f"benchmark of {kind} {minutes} {resolution} failed")
+
+    with open(result_file, "r") as file:
+        run = json.loads(file.read())
+    os.remove(result_file)
+    return run
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--lengths",
+        type=float,
+        nargs="+",
+        default=[1, 5],
+        help="story lengths in minutes",
+    )
+    parser.add_argument(
+        "--kinds", nargs="+", default=["story", "comment"], choices=["story", "comment"]
+    )
+    parser.add_argument("--resolutions", nargs="+", default=["1920x1080", "1080x1920"])
+    parser.add_argument(
+        "--backend", choices=["moviepy", "compositor", "ffmpeg", "parallel"]
+    )
+    parser.add_argument("--background-size", default="2560x1440")
+    parser.add_argument("--workdir", default="tmp/benchmark/")
+    parser.add_argument("--output", default="benchmark_results/")
+    # used internally to run a single configuration in its own process
+    parser.add_argument("--run-one", nargs=3, help=argparse.SUPPRESS)
+    parser.add_argument("--background-file", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one != None:
+        if args.backend != None:
+            video_generator.config.render_backend = args.backend
+        install_stubs(args.workdir)
+        kind, minutes, resolution = args.run_one
+        width, height = resolution.split("x")
+        run = run_benchmark(
+            kind,
+            float(minutes),
+            (int(width), int(height)),
+            args.background_file,
+            args.workdir,
+        )
+        with open(args.result_file, "w") as file:
+            file.write(json.dumps(run))
+        sys.exit(0)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    os.makedirs(args.output, exist_ok=True)
+
+    # long enough for the longest story plus intro and outro
+    background_file = generate_background_video(
+        args.workdir, max(args.lengths) * 60 * 1.5 + 60, args.background_size
+    )
+
+    runs: list[dict] = []
+    for kind in args.kinds:
+        for minutes in args.lengths:
+            for resolution in args.resolutions:
+                runs.append(
+                    run_benchmark_in_subprocess(
+                        kind, minutes, resolution, background_file, args
+                    )
+                )
+                print(
+                    json.dumps(
+                        {
+                            key: value
+                            for key, value in runs[-1].items()
+                            if key != "stages"
+                        }
+                    )
+                )
+
+    commit = current_commit()
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    result_file = os.path.join(args.output, f"{timestamp}-{commit}.json")
+    with open(result_file, "w") as file:
+        file.write(
+            json.dumps({"commit": commit, "created": timestamp, "runs": runs}, indent=4)
+        )
+    print(f"saved results to {result_file}")
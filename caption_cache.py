@@ -0,0 +1,133 @@
+from collections import OrderedDict
+import hashlib
+import os
+import weakref
+import numpy as np
+from PIL import Image
+from moviepy import TextClip, VideoClip
+from caption_renderer import render_caption_native
+from configuration import Configuration
+from instrumentation import span
+
+config = Configuration()
+
+
+def caption_key(text: str, font_size: int, box_width: float) -> str:
+    parts = [
+        text,
+        config.caption_renderer,
+        config.video_font,
+        config.video_font_file,
+        str(font_size),
+        config.video_font_color,
+        config.video_font_stroke_color,
+        str(config.video_font_stroke_width),
+        f"{box_width:.1f}",
+    ]
+    return hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def render_caption(text: str, font_size: int, box_width: float) -> np.ndarray:
+    if config.caption_renderer == "pillow":
+        return render_caption_native(text, font_size, box_width)
+
+    text_clip = TextClip(
+        text=text,
+        method="caption",
+        color=config.video_font_color,
+        font=config.video_font,
+        font_size=font_size,
+        stroke_color=config.video_font_stroke_color,
+        stroke_width=config.video_font_stroke_width,
+        size=(box_width, 0),
+        align="center",
+    )
+    rgb = text_clip.get_frame(0)
+    alpha = text_clip.mask.get_frame(0) * 255  # type: ignore
+    return np.dstack((rgb, alpha)).astype(np.uint8)
+
+
+class CachedCaption:
+    """Caption bitmap split the way clips use it, so frames can be returned
+    as they are. The arrays are read-only because every clip shares them."""
+
+    def __init__(self, rgba: np.ndarray) -> None:
+        self.rgba = rgba
+        self.rgb = np.ascontiguousarray(rgba[..., :3])
+        self.mask = rgba[..., 3] / 255
+        for array in [self.rgb, self.mask]:
+            array.flags.writeable = False
+
+
+class CaptionCache:
+    """Rendered caption bitmaps keyed by their text and style. The most
+    recently used ones are kept in memory, all of them optionally on disk."""
+
+    def __init__(self, max_entries: int, directory: str | None) -> None:
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries: OrderedDict[str, CachedCaption] = OrderedDict()
+
+        if directory != None:
+            os.makedirs(directory, exist_ok=True)
+
+    def load_from_disk(self, key: str) -> np.ndarray | None:
+        if self.directory == None:
+            return None
+        filename = os.path.join(self.directory, key + ".png")
+        if not os.path.exists(filename):
+            return None
+        with Image.open(filename) as image:
+            return np.asarray(image.convert("RGBA"))
+
+    def save_to_disk(self, key: str, rgba: np.ndarray):
+        if self.directory == None:
+            return
+        filename = os.path.join(self.directory, key + ".png")
+        Image.fromarray(rgba, "RGBA").save(filename + ".tmp", format="PNG")
+        os.replace(filename + ".tmp", filename)
+
+    def entry(
+        self, key: str, text: str, font_size: int, box_width: float
+    ) -> CachedCaption:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        rgba = self.load_from_disk(key)
+        if rgba is None:
+            with span("caption_render"):
+                rgba = render_caption(text, font_size, box_width)
+            self.save_to_disk(key, rgba)
+
+        cached = CachedCaption(rgba)
+        self.entries[key] = cached
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return cached
+
+    def get(self, text: str, font_size: int, box_width: float) -> np.ndarray:
+        key = caption_key(text, font_size, box_width)
+        return self.entry(key, text, font_size, box_width).rgba
+
+
+caption_cache = CaptionCache(config.caption_cache_size, config.caption_cache_dir)
+
+
+def caption_clip(text: str, font_size: int, box_width: float) -> VideoClip:
+    """Caption that only holds its bitmap while it is in the caption cache.
+    The key is hashed once and the entry is only looked up again after it
+    was evicted, every frame returns the same cached arrays."""
+    key = caption_key(text, font_size, box_width)
+    current: list[weakref.ref] = []
+
+    def cached() -> CachedCaption:
+        entry = current[0]() if len(current) > 0 else None
+        if entry == None:
+            entry = caption_cache.entry(key, text, font_size, box_width)
+            current[:] = [weakref.ref(entry)]
+        return entry
+
+    clip = VideoClip(make_frame=lambda t: cached().rgb)
+    mask = VideoClip(make_frame=lambda t: cached().mask, is_mask=True)
+    return clip.with_mask(mask)
@@ -0,0 +1,96 @@
+from bisect import bisect_right
+from typing import Tuple
+import numpy as np
+from moviepy import VideoClip
+from render_timeline import SavedCaption, TimelineCaption
+
+
+class CaptionSprite:
+    """Caption image cropped to its visible pixels with the blending factors
+    precomputed, so that putting it on a frame is a single small blit."""
+
+    def __init__(self, rgba: np.ndarray, resolution: Tuple[int, int]) -> None:
+        visible_rows = np.flatnonzero(rgba[..., 3].any(axis=1))
+        visible_columns = np.flatnonzero(rgba[..., 3].any(axis=0))
+
+        if len(visible_rows) == 0:
+            self.empty = True
+            return
+        self.empty = False
+
+        top, bottom = visible_rows[0], visible_rows[-1] + 1
+        left, right = visible_columns[0], visible_columns[-1] + 1
+
+        # same placement as with_position("center") on the full caption image
+        offset_x = (resolution[0] - rgba.shape[1]) // 2
+        offset_y = (resolution[1] - rgba.shape[0]) // 2
+
+        # clip the sprite to the frame
+        x1 = max(0, offset_x + left)
+        y1 = max(0, offset_y + top)
+        x2 = min(resolution[0], offset_x + right)
+        y2 = min(resolution[1], offset_y + bottom)
+        if x1 >= x2 or y1 >= y2:
+            self.empty = True
+            return
+
+        sprite = rgba[y1 - offset_y : y2 - offset_y, x1 - offset_x : x2 - offset_x]
+        alpha = sprite[..., 3:4].astype(np.uint16)
+
+        self.x1, self.y1, self.x2, self.y2 = x1, y1, x2, y2
+        self.premultiplied = sprite[..., :3].astype(np.uint16) * alpha + 127
+        self.inverse_alpha = 255 - alpha
+
+    def blend(self, frame: np.ndarray):
+        if self.empty:
+            return
+        region = frame[self.y1 : self.y2, self.x1 : self.x2]
+        blended = region * self.inverse_alpha
+        blended += self.premultiplied
+        blended //= 255
+        region[...] = blended
+
+
+class CaptionTrack:
+    """Puts the captions of a timeline onto background frames. The active
+    caption is found with a binary search over the sorted start times and
+    its sprite is only built once, when it first becomes visible."""
+
+    def __init__(
+        self,
+        captions: list[TimelineCaption] | list[SavedCaption],
+        resolution: Tuple[int, int],
+    ) -> None:
+        self.resolution = resolution
+        self.captions = sorted(captions, key=lambda caption: caption.start)
+        self.starts = [caption.start for caption in self.captions]
+        self.current_index: int | None = None
+        self.current_sprite: CaptionSprite | None = None
+
+    def active_index(self, t: float) -> int | None:
+        index = bisect_right(self.starts, t) - 1
+        if index < 0 or t > self.captions[index].end:
+            return None
+        return index
+
+    def sprite(self, index: int) -> CaptionSprite:
+        if index != self.current_index:
+            self.current_index = index
+            self.current_sprite = CaptionSprite(
+                self.captions[index].to_rgba(), self.resolution
+            )
+        return self.current_sprite  # type: ignore
+
+    def composite(self, frame: np.ndarray, t: float) -> np.ndarray:
+        index = self.active_index(t)
+        if index == None:
+            return frame
+
+        if not frame.flags.writeable:
+            frame = frame.copy()
+        self.sprite(index).blend(frame)
+        return frame
+
+
+def composite_captions(background: VideoClip, track: CaptionTrack) -> VideoClip:
+    return background.transform(lambda get_frame, t: track.composite(get_frame(t), t))
@@ -0,0 +1,165 @@
+from math import ceil
+from typing import Callable, Tuple
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+from configuration import Configuration
+
+config = Configuration()
+
+
+class Glyph:
+    def __init__(
+        self,
+        advance: float,
+        left: int,
+        top: int,
+        outline: np.ndarray,
+        fill: np.ndarray,
+    ) -> None:
+        self.advance = advance
+        self.left = left
+        self.top = top
+        # coverage of fill plus stroke and of the fill alone
+        self.outline = outline
+        self.fill = fill
+
+
+class GlyphAtlas:
+    """Every glyph of one font, size and stroke width rasterised once."""
+
+    def __init__(self, font_file: str, font_size: int, stroke_width: int) -> None:
+        self.font = ImageFont.truetype(font_file, font_size)
+        self.stroke_width = stroke_width
+        self.glyphs: dict[str, Glyph] = {}
+
+        ascent, descent = self.font.getmetrics()
+        self.line_height = ascent + descent + 2 * stroke_width
+
+    def glyph(self, char: str) -> Glyph:
+        if char in self.glyphs:
+            return self.glyphs[char]
+
+        left, top, right, bottom = self.font.getbbox(
+            char, stroke_width=self.stroke_width
+        )
+        size = (max(0, right - left), max(0, bottom - top))
+        masks: list[np.ndarray] = []
+        for stroke_width in [self.stroke_width, 0]:
+            image = Image.new("L", size, 0)
+            ImageDraw.Draw(image).text(
+                (-left, -top),
+                char,
+                font=self.font,
+                fill=255,
+                stroke_width=stroke_width,
+                stroke_fill=255,
+            )
+            masks.append(np.asarray(image))
+
+        glyph = Glyph(self.font.getlength(char), left, top, masks[0], masks[1])
+        self.glyphs[char] = glyph
+        return glyph
+
+    def text_width(self, text: str) -> float:
+        return sum(self.glyph(char).advance for char in text)
+
+
+atlases: dict[Tuple[str, int, int], GlyphAtlas] = {}
+colour_tables: dict[Tuple[str, str], np.ndarray] = {}
+
+
+def get_atlas(font_size: int) -> GlyphAtlas:
+    key = (config.video_font_file, font_size, config.video_font_stroke_width)
+    if key not in atlases:
+        atlases[key] = GlyphAtlas(*key)
+    return atlases[key]
+
+
+def get_colour_table(fill_color: str, stroke_color: str) -> np.ndarray:
+    """RGBA pixel packed into an uint32 for every pair of outline and fill
+    coverage, so colouring a caption is a single lookup per pixel."""
+    key = (fill_color, stroke_color)
+    if key in colour_tables:
+        return colour_tables[key]
+
+    outline = np.arange(256, dtype=np.uint8)[:, np.newaxis]
+    fill = np.arange(256, dtype=np.uint8)[np.newaxis, :]
+    fill_rgb = np.array(ImageColor.getrgb(fill_color)[:3], np.float32)
+    stroke_rgb = np.array(ImageColor.getrgb(stroke_color)[:3], np.float32)
+    # share of the fill in the visible pixel, the rest is stroke, mixed in
+    # float and rounded exactly like the whole caption used to be
+    fill_ratio = np.minimum(fill / np.maximum(outline, 1), 1)[..., np.newaxis]
+    rgb = stroke_rgb + (fill_rgb - stroke_rgb) * fill_ratio
+
+    table = np.empty((256, 256, 4), dtype=np.uint8)
+    table[..., :3] = rgb.round()
+    table[..., 3] = outline
+    colour_tables[key] = table.view(np.uint32).reshape(256, 256)
+    return colour_tables[key]
+
+
+def wrap_lines(
+    text_width: Callable[[str], float], text: str, max_width: float
+) -> list[str]:
+    # greedy line breaking, a word that is too long gets a line of its own
+    space_width = text_width(" ")
+    lines: list[str] = []
+
+    for paragraph in text.split("\n"):
+        line: list[str] = []
+        line_width = 0.0
+        for word in paragraph.split():
+            word_width = text_width(word)
+            if len(line) > 0 and line_width + space_width + word_width > max_width:
+                lines.append(" ".join(line))
+                line = []
+                line_width = 0.0
+            if len(line) > 0:
+                line_width += space_width
+            line.append(word)
+            line_width += word_width
+        lines.append(" ".join(line))
+
+    return lines
+
+
+def render_caption_native(text: str, font_size: int, box_width: float) -> np.ndarray:
+    atlas = get_atlas(font_size)
+    stroke_width = atlas.stroke_width
+    lines = wrap_lines(atlas.text_width, text, box_width - 2 * stroke_width)
+    line_widths = [atlas.text_width(line) + 2 * stroke_width for line in lines]
+
+    width = ceil(max([box_width] + line_widths))
+    height = atlas.line_height * len(lines)
+    outline = np.zeros((height, width), dtype=np.uint8)
+    fill = np.zeros((height, width), dtype=np.uint8)
+    used_left, used_right = width, 0
+
+    for line_index, line in enumerate(lines):
+        pen_x = (width - line_widths[line_index]) / 2 + stroke_width
+        line_top = line_index * atlas.line_height + stroke_width
+        for char in line:
+            glyph = atlas.glyph(char)
+            x = round(pen_x) + glyph.left
+            y = line_top + glyph.top
+            pen_x += glyph.advance
+
+            glyph_height, glyph_width = glyph.outline.shape
+            x1, y1 = max(0, x), max(0, y)
+            x2, y2 = min(width, x + glyph_width), min(height, y + glyph_height)
+            if x1 >= x2 or y1 >= y2:
+                continue
+
+            source = np.s_[y1 - y : y2 - y, x1 - x : x2 - x]
+            target = np.s_[y1:y2, x1:x2]
+            np.maximum(outline[target], glyph.outline[source], out=outline[target])
+            np.maximum(fill[target], glyph.fill[source], out=fill[target])
+            used_left, used_right = min(used_left, x1), max(used_right, x2)
+
+    # everything outside the written columns stays fully transparent
+    table = get_colour_table(config.video_font_color, config.video_font_stroke_color)
+    pixels = np.zeros((height, width), dtype=np.uint32)
+    if used_left < used_right:
+        used = np.s_[:, used_left:used_right]
+        pixels[used] = table[outline[used], fill[used]]
+    return pixels.view(np.uint8).reshape(height, width, 4)
@@ -1,20 +1,26 @@
 from datetime import timedelta
-from random import randrange
-from typing import Literal, Tuple
+from random import sample
+from typing import Iterator, Literal, Tuple
 
 from moviepy import *
+from caption_cache import caption_clip
+from instrumentation import span
 from configuration import Configuration
 from video_utils import (
     CHARS_PER_SECOND,
     check_if_valid_post,
     crop_to_center_and_resize,
+    generate_intro_audio,
     generate_intro_clip,
+    generate_outro_audio,
     generate_outro_clip,
     select_background_video,
 )
 from openai_interface import OpenAiInterface
-from reddit_requests import Comment, Post, PostSearch
-from text_processing import split_text_to_max_x_chars
+from reddit_requests import Comment, Post, PostSearch, search_subreddits
+from post_store import post_store
+from render_timeline import Timeline
+from text_processing import text_chunks
 
 config = Configuration()
 
@@ -22,7 +28,7 @@ config = Configuration()
 def calculate_font_size(text: str) -> Tuple[list[str], list[int]]:
     # TODO implement text_wall_font_size configuration option
 
-    text_parts: list[str] = split_text_to_max_x_chars(text, 550)
+    text_parts: list[str] = list(text_chunks(text, 550))
     font_sizes: list[int] = []
 
     for part in text_parts:
@@ -36,66 +42,118 @@ def calculate_font_size(text: str) -> Tuple[list[str], list[int]]:
     return (text_parts, font_sizes)
 
 
-def generate_single_comment_clip(
+class CommentPart:
+    def __init__(self, text: str, font_size: int, audio_file: str) -> None:
+        self.text = text
+        self.font_size = font_size
+        self.audio_file = audio_file
+
+
+class CommentNarration:
+    """Comments of a post split into parts with their speech. They are
+    created once and shared by every resolution the video is rendered in."""
+
+    def __init__(
+        self,
+        comments: list[list[CommentPart]],
+        intro_audio: str | None,
+        outro_audio: str | None,
+    ) -> None:
+        self.comments = comments
+        self.intro_audio = intro_audio
+        self.outro_audio = outro_audio
+
+
+def comment_char_limit(approx_video_duration: timedelta | None) -> int | None:
+    """How many characters of comments fill the video, None for no limit."""
+    if approx_video_duration == None:
+        return None
+    return int(approx_video_duration.total_seconds() * CHARS_PER_SECOND)
+
+
+def generate_comment_narration(
     post: Post,
-    text_parts: list[str],
-    font_sizes: list[int],
+    add_intro: bool,
+    add_outro: bool,
+    approx_video_duration: timedelta | None = None,
+) -> CommentNarration:
+    intro_audio = generate_intro_audio(post) if add_intro else None
+    outro_audio = generate_outro_audio(post) if add_outro else None
+
+    # with the same limit as find_comment_post the comments reddit left out
+    # of the thread are loaded here too
+    with span("reddit_comments"):
+        comments: list[Comment] = post.get_good_comments(
+            num_chars_to_limit_comments=comment_char_limit(approx_video_duration)
+        )
+    print(f"There are {len(comments)} good comments")
+
+    openaiinterface = OpenAiInterface()
+    comment_parts: list[list[CommentPart]] = []
+    for index, comment in enumerate(comments):
+        print(comment)
+
+        text_parts, font_sizes = calculate_font_size(comment.body)
+        if len(text_parts) > 1:
+            print(f"Splitting Comment into {len(text_parts)} parts")
+
+        parts: list[CommentPart] = []
+        for i, part in enumerate(text_parts):
+            audio_file = f"tmp/{post.post_id}-audio-{index}-part-{i}.mp3"
+            openaiinterface.generate_mp3(part, audio_file)
+            parts.append(CommentPart(part, font_sizes[i], audio_file))
+        comment_parts.append(parts)
+
+    return CommentNarration(comment_parts, intro_audio, outro_audio)
+
+
+def generate_single_comment_clip(
+    parts: list[CommentPart],
     resolution: Tuple[int, int],
-    index: int,
+    timeline: Timeline | None = None,
 ):
-    openaiinterface = OpenAiInterface()
     comment_clip_parts: list[VideoClip] = []
 
-    for i, part in enumerate(text_parts):
-        openaiinterface.generate_mp3(
-            part, f"tmp/{post.post_id}-audio-{index}-part-{i}.mp3"
-        )
-        clip_part: VideoClip = TextClip(
-            part,
-            size=(resolution[0] * 0.8, 0),
-            color=config.video_font_color,
-            font=config.video_font,
-            font_size=font_sizes[i],
-            method="caption",
-            stroke_color=config.video_font_stroke_color,
-            stroke_width=config.video_font_stroke_width,
-            align="center",
+    for part in parts:
+        clip_part: VideoClip = caption_clip(
+            part.text, part.font_size, resolution[0] * 0.8
         )
-
-        audio_clip = AudioFileClip(f"tmp/{post.post_id}-audio-{index}-part-{i}.mp3")
+        audio_clip = AudioFileClip(part.audio_file)
         clip_part = clip_part.with_duration(audio_clip.duration + 1)
         clip_part = clip_part.with_audio(audio_clip)
         comment_clip_parts.append(clip_part)
 
+        if timeline != None:
+            timeline.add_caption(clip_part, 0, clip_part.duration)
+            timeline.advance(clip_part.duration)
+
     comment_clip = concatenate_videoclips(comment_clip_parts)
     return comment_clip
 
 
-def generate_comments_clip(post: Post, resolution: Tuple[int, int], add_intro: bool, add_outro: bool) -> VideoClip:
+def generate_comments_clip(
+    post: Post,
+    resolution: Tuple[int, int],
+    narration: CommentNarration,
+    timeline: Timeline | None = None,
+) -> VideoClip:
     text_clips: list[VideoClip] = []
     
     intro: VideoClip | None = None
     outro: VideoClip | None = None
 
-    if add_intro:
-        intro = generate_intro_clip(post, resolution)
-    if add_outro:
-        outro = generate_outro_clip(post, resolution)
+    if narration.intro_audio != None:
+        intro = generate_intro_clip(post, resolution, narration.intro_audio)
+    if narration.outro_audio != None:
+        outro = generate_outro_clip(narration.outro_audio)
     
 
-    comments: list[Comment] = post.get_good_comments()
-    print(f"There are {len(comments)} good comments")
-
-    for index, comment in enumerate(comments):
-        print(comment)
-
-        text_parts, font_sizes = calculate_font_size(comment.body)
-        if len(text_parts) > 1:
-            print(f"Splitting Comment into {len(text_parts)} parts")
+    if timeline != None and intro != None:
+        timeline.add_caption(intro, 0, intro.duration)
+        timeline.advance(intro.duration)
 
-        comment_clip = generate_single_comment_clip(
-            post, text_parts, font_sizes, resolution, index
-        )
+    for parts in narration.comments:
+        comment_clip = generate_single_comment_clip(parts, resolution, timeline)
         text_clips.append(comment_clip)
         
     combined_text_video: VideoClip = concatenate_videoclips(text_clips)
@@ -106,38 +164,70 @@ def generate_comments_clip(post: Post, resolution: Tuple[int, int], add_intro: b
     if outro != None:
         video_duration += outro.duration
     print(f"the video will be {video_duration}s long")
-    
-    
+
+    # the outro has no visible text
+    if timeline != None and outro != None:
+        timeline.advance(outro.duration)
+
     to_combine = [clip for clip in [intro, combined_text_video, outro] if clip != None]
     combined_text_video = concatenate_videoclips(to_combine)
     combined_text_video = combined_text_video.with_position("center")
     return combined_text_video
 
 
+def comment_post_candidates(
+    timeframe: Literal["day", "week", "month", "year", "all"],
+    listing: Literal["controversial", "best", "hot", "new", "random", "rising", "top"],
+    subreddit_list: list[str],
+    posts_per_subreddit: int,
+) -> Iterator[Post]:
+    # only checks that do not need the comments of a post happen here
+    def is_candidate(p: Post) -> bool:
+        return check_if_valid_post(p.post_id, p.title, "", p.nsfw)
+
+    # the first pages of all subreddits are requested at once and the best
+    # posts of the post store are tried first, after that the subreddits are
+    # paged through one by one
+    post_store.add_posts(
+        search_subreddits(subreddit_list, listing, timeframe), listing, timeframe
+    )
+    seen: set[str] = set()
+    for p in post_store.candidates(subreddit_list, listing, timeframe):
+        seen.add(p.post_id)
+        if is_candidate(p):
+            yield p
+
+    for subreddit in dict.fromkeys(sample(subreddit_list, len(subreddit_list))):
+        search = PostSearch(subreddit, listing, timeframe, lazy=True)
+        yield from search.iter_posts(
+            limit=posts_per_subreddit,
+            predicate=lambda p: p.post_id not in seen and is_candidate(p),
+        )
+
+
 def find_comment_post(
     timeframe: Literal["day", "week", "month", "year", "all"],
     listing: Literal["controversial", "best", "hot", "new", "random", "rising", "top"],
     subreddit_list: list[str],
     approx_video_duration: timedelta | None = None
 ):
-    selected_post = None
+    # loading the comments of a post is expensive, so only posts that pass
+    # the checks that do not need them count as attempts
     max_attempts = 50
-    for i in range(0, max_attempts):
-        subreddit = subreddit_list[randrange(0, len(subreddit_list))]
-        search = PostSearch(subreddit, listing, timeframe)
-
-        if not hasattr(search, "posts") or len(search.posts) < 1:
-            continue
-        p = search.posts[randrange(0, len(search.posts))]
-
-        if approx_video_duration != None:
-            good_comments = p.get_good_comments(
-                num_chars_to_limit_comments=int(
-                    approx_video_duration.total_seconds() * CHARS_PER_SECOND
-                )
-            )
-        else:
-            good_comments = p.get_good_comments()
+    attempts = 0
+    for p in comment_post_candidates(
+        timeframe,
+        listing,
+        subreddit_list,
+        max(1, max_attempts // len(set(subreddit_list))),
+    ):
+        if attempts >= max_attempts:
+            break
+        attempts += 1
+
+        good_comments = p.get_good_comments(
+            num_chars_to_limit_comments=comment_char_limit(approx_video_duration)
+        )
 
         comments_combined = " ".join([c.body for c in good_comments])
 
@@ -150,10 +240,6 @@ def find_comment_post(
         )
 
         if valid:
-            selected_post = p
-            break
-        
-    if selected_post == None:
-        raise Exception(f"No valid post found in {max_attempts} attempts.")
-    
-    return selected_post
+            return p
+
+    raise Exception(f"No valid post found in {attempts} attempts.")
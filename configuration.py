@@ -12,25 +12,51 @@ class Configuration:
 
         self.output_dir = config["output_dir"]
         self.background_videos_dir = config["background_videos_dir"]
+        self.background_index_file: str = config["background_index_file"]
+        self.background_index_ttl: float = config["background_index_ttl"]
+        self.background_proxies_dir: str = config["background_proxies_dir"]
+        self.background_proxy_resolutions: list[list[int]] = config[
+            "background_proxy_resolutions"
+        ]
+        self.background_proxy_gop_seconds: float = config[
+            "background_proxy_gop_seconds"
+        ]
         self.tolerated_duration_offset = config["tolerated_duration_offset"]
         self.intro_header: str = config["intro_header"]
         self.intro_prompt: str = config["intro_prompt"]
         self.outro_prompt: str = config["outro_prompt"]
         self.video_title_prompt: str = config["video_title_prompt"]
         self.background_video_volume: float = config["background_video_volume"]
+        self.instrumentation_summary_file: str | None = config[
+            "instrumentation_summary_file"
+        ]
         
 
         self.init_video_text(config)
 
         self.init_openai(config)
+        self.init_reddit(config)
+        self.init_transport(config)
         self.init_moviepy(config)
 
         self.init_thumbnail(config_thumbnail_with_text)
 
     def init_thumbnail(self, config_thumbnail_with_text):
+        self.thumbnail_renderer: Literal["moviepy", "pillow"] = (
+            config_thumbnail_with_text["thumbnail_renderer"]
+        )
         self.thumbnail_subreddit_icon_size: int = config_thumbnail_with_text[
             "thumbnail_subreddit_icon_size"
         ]
+        self.thumbnail_icon_cache_dir: str | None = config_thumbnail_with_text[
+            "thumbnail_icon_cache_dir"
+        ]
+        self.thumbnail_icon_cache_ttl: float = config_thumbnail_with_text[
+            "thumbnail_icon_cache_ttl"
+        ]
+        self.thumbnail_icon_request_timeout: float = config_thumbnail_with_text[
+            "thumbnail_icon_request_timeout"
+        ]
         self.thumbnail_subreddit_text_size: int = config_thumbnail_with_text[
             "thumbnail_subreddit_text_size"
         ]
@@ -40,6 +66,9 @@ class Configuration:
         self.thumbnail_subreddit_text_font: str = config_thumbnail_with_text[
             "thumbnail_subreddit_text_font"
         ]
+        self.thumbnail_subreddit_text_font_file: str = config_thumbnail_with_text[
+            "thumbnail_subreddit_text_font_file"
+        ]
         self.thumbnail_main_text_size: int = config_thumbnail_with_text[
             "thumbnail_main_text_size"
         ]
@@ -49,6 +78,9 @@ class Configuration:
         self.thumbnail_main_text_font: str = config_thumbnail_with_text[
             "thumbnail_main_text_font"
         ]
+        self.thumbnail_main_text_font_file: str = config_thumbnail_with_text[
+            "thumbnail_main_text_font_file"
+        ]
         self.thumbnail_like_icon_size: int = config_thumbnail_with_text[
             "thumbnail_like_icon_size"
         ]
@@ -61,6 +93,9 @@ class Configuration:
         self.thumbnail_like_text_font: str = config_thumbnail_with_text[
             "thumbnail_like_text_font"
         ]
+        self.thumbnail_like_text_font_file: str = config_thumbnail_with_text[
+            "thumbnail_like_text_font_file"
+        ]
         self.thumbnail_element_margin: int = config_thumbnail_with_text[
             "thumbnail_element_margin"
         ]
@@ -82,15 +117,50 @@ class Configuration:
 
     def init_video_text(self, config):
         self.video_font: str = config["video_font"]
+        self.video_font_file: str = config["video_font_file"]
+        self.caption_renderer: Literal["imagemagick", "pillow"] = config[
+            "caption_renderer"
+        ]
         self.video_font_color: str = config["video_font_color"]
         self.video_font_size: int = config["video_font_size"]
         self.video_font_stroke_width: int = config["video_font_stroke_width"]
         self.video_font_stroke_color: str = config["video_font_stroke_color"]
+        self.caption_cache_size: int = config["caption_cache_size"]
+        self.caption_cache_dir: str | None = config["caption_cache_dir"]
 
     def init_moviepy(self, config):
         self.video_fps: int = config["video_fps"]
         self.write_video_preset: str = config["write_video_preset"]
         self.num_threads: int = config["num_threads"]
+        self.render_backend: Literal[
+            "moviepy", "compositor", "ffmpeg", "parallel"
+        ] = config["render_backend"]
+        self.render_workers: int = config["render_workers"]
+
+    def init_reddit(self, config):
+        self.reddit_cache_dir: str | None = config["reddit_cache_dir"]
+        self.reddit_cache_ttl: float = config["reddit_cache_ttl"]
+        self.reddit_cache_size: int = config["reddit_cache_size"]
+        self.reddit_request_timeout: float = config["reddit_request_timeout"]
+        self.reddit_max_concurrent_requests: int = config[
+            "reddit_max_concurrent_requests"
+        ]
+        self.reddit_user_agent: str = config["reddit_user_agent"]
+        self.reddit_requests_per_minute: float = config["reddit_requests_per_minute"]
+        self.reddit_ratelimit_reserve: int = config["reddit_ratelimit_reserve"]
+        self.reddit_max_retries: int = config["reddit_max_retries"]
+        self.reddit_backoff_base: float = config["reddit_backoff_base"]
+        self.reddit_backoff_max: float = config["reddit_backoff_max"]
+        self.post_store_file: str = config["post_store_file"]
+        self.post_store_max_age: float = config["post_store_max_age"]
+        self.already_posted_file: str = config["already_posted_file"]
+
+    def init_transport(self, config):
+        self.http_transport_mode: Literal["live", "record", "replay"] = config[
+            "http_transport_mode"
+        ]
+        self.http_cassette_dir: str = config["http_cassette_dir"]
+        self.http_replay_latency: float = config["http_replay_latency"]
 
     def init_openai(self, config):
         with open("config/secrets.json", "r") as file:
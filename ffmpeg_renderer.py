@@ -0,0 +1,167 @@
+import os
+import subprocess
+from typing import Tuple
+from PIL import Image
+from configuration import Configuration
+from render_timeline import SavedCaption, Timeline
+
+config = Configuration()
+
+
+def crop_and_scale_filter(resolution: Tuple[int, int], fps: int) -> str:
+    width, height = resolution
+    aspect_ratio = width / height
+    return (
+        f"crop=w='min(iw,ih*{aspect_ratio:.6f})':h='min(ih,iw/{aspect_ratio:.6f})',"
+        f"scale={width}:{height},setsar=1,fps={fps}"
+    )
+
+
+def audio_mix_filters(
+    narration_input: int,
+    background_input: int,
+    background_has_audio: bool,
+    output: str = "aout",
+) -> list[str]:
+    if not background_has_audio:
+        return [f"[{narration_input}:a]anull[{output}]"]
+    return [
+        f"[{background_input}:a]volume={config.background_video_volume}[bga]",
+        f"[{narration_input}:a][bga]amix=inputs=2:duration=first:normalize=0[{output}]",
+    ]
+
+
+def write_caption_stream(
+    captions: list[SavedCaption],
+    blank_file: str,
+    duration: float,
+    filename: str,
+):
+    """Concat list that shows every caption for as long as it is visible and
+    the blank frame in between. ffmpeg reads it as a single input that only
+    opens one image at a time, however many captions there are."""
+    entries: list[tuple[str, float]] = []
+    time = 0.0
+    for caption in sorted(captions, key=lambda caption: caption.start):
+        start = min(max(caption.start, time), duration)
+        end = min(max(caption.end, start), duration)
+        if start > time:
+            entries.append((blank_file, start - time))
+        if end > start:
+            entries.append((caption.filename, end - start))
+        time = end
+    if time < duration or len(entries) == 0:
+        entries.append((blank_file, max(duration - time, 0)))
+
+    with open(filename, "w") as file:
+        file.write("ffconcat version 1.0\n")
+        for image_file, image_duration in entries:
+            escaped = os.path.abspath(image_file).replace("'", "'\\''")
+            file.write(f"file '{escaped}'\nduration {image_duration:.6f}\n")
+        # the duration of the last entry is only used when it is repeated
+        file.write(f"file '{escaped}'\n")
+
+
+def build_filter_graph(timelines: list[Timeline]) -> str:
+    # input 0 is the background video, input 1 the narration, followed by one
+    # caption stream per timeline. The background is decoded once and split up.
+    num_outputs = len(timelines)
+    filters: list[str] = [
+        "[0:v]split=" + str(num_outputs) + "".join(f"[bg{k}]" for k in range(num_outputs))
+    ]
+
+    for k, timeline in enumerate(timelines):
+        filters.append(
+            f"[bg{k}]{crop_and_scale_filter(timeline.resolution, config.video_fps)}[scaled{k}]"
+        )
+        filters.append(f"[{2 + k}:v]format=rgba[captions{k}]")
+        # the caption stream has one frame per caption, overlay keeps showing
+        # the last one until the next arrives
+        filters.append(
+            f"[scaled{k}][captions{k}]overlay=x=0:y=0:eof_action=repeat[vout{k}]"
+        )
+
+    filters += audio_mix_filters(1, 0, timelines[0].background.has_audio, "amixed")
+    filters.append(
+        "[amixed]asplit="
+        + str(num_outputs)
+        + "".join(f"[aout{k}]" for k in range(num_outputs))
+    )
+
+    return ";\n".join(filters)
+
+
+def render_timelines_with_ffmpeg(
+    timelines: list[Timeline], filenames: list[str], tmp_prefix: str
+):
+    """Renders several timelines that share their background window and
+    narration, e.g. the same video in different resolutions, in one pass."""
+    first = timelines[0]
+    if first.background == None or first.narration_audio == None:
+        raise Exception("Timeline is missing background video or narration audio")
+
+    caption_streams: list[str] = []
+    num_captions = 0
+    for timeline in timelines:
+        width, height = timeline.resolution
+        prefix = f"{tmp_prefix}-{width}x{height}"
+        captions = timeline.save_caption_frames(prefix)
+        num_captions += len(captions)
+
+        blank_file = f"{prefix}-blank.png"
+        Image.new("RGBA", timeline.resolution, (0, 0, 0, 0)).save(blank_file)
+        caption_streams.append(f"{prefix}-captions.txt")
+        write_caption_stream(
+            captions, blank_file, first.duration, caption_streams[-1]
+        )
+
+    filter_script = f"{tmp_prefix}-filter.txt"
+    with open(filter_script, "w") as file:
+        file.write(build_filter_graph(timelines))
+
+    command = [
+        "ffmpeg",
+        "-y",
+        "-ss",
+        f"{first.background.start_time:.3f}",
+        "-t",
+        f"{first.duration:.3f}",
+        "-i",
+        first.background.filename,
+        "-i",
+        first.narration_audio,
+    ]
+    for caption_stream in caption_streams:
+        command += ["-f", "concat", "-safe", "0", "-i", caption_stream]
+    command += ["-filter_complex_script", filter_script]
+    for k, filename in enumerate(filenames):
+        command += [
+            "-map",
+            f"[vout{k}]",
+            "-map",
+            f"[aout{k}]",
+            "-c:v",
+            "libx264",
+            "-preset",
+            config.write_video_preset,
+            "-threads",
+            str(config.num_threads),
+            "-pix_fmt",
+            "yuv420p",
+            "-c:a",
+            "aac",
+            "-t",
+            f"{first.duration:.3f}",
+            filename,
+        ]
+
+    print(f"rendering {num_captions} captions with ffmpeg to {filenames}")
+    result = subprocess.run(command)
+    try:
+        result.check_returncode()
+    except subprocess.CalledProcessError:
+        raise Exception("ffmpeg rendering failed")
+
+
+def render_timeline_with_ffmpeg(timeline: Timeline, filename: str, tmp_prefix: str):
+    render_timelines_with_ffmpeg([timeline], [filename], tmp_prefix)
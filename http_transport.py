@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Awaitable, Callable, Literal
+from configuration import Configuration
+
+config = Configuration()
+
+
+class Transport:
+    """Every response from reddit, subreddit icons and openai passes through
+    here. In "live" mode requests are just sent, "record" mode additionally
+    writes each response to the cassette directory and "replay" mode answers
+    from the recordings without any network access, after latency seconds."""
+
+    def __init__(
+        self,
+        mode: Literal["live", "record", "replay"],
+        directory: str,
+        latency: float,
+    ) -> None:
+        if mode not in ["live", "record", "replay"]:
+            raise Exception(f"unknown http transport mode {mode}")
+        self.mode = mode
+        self.directory = directory
+        self.latency = latency
+
+        if mode == "record":
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def live(self) -> bool:
+        return self.mode == "live"
+
+    def filename(self, kind: str, request: dict, extension: str) -> str:
+        # the same request always ends up in the same file
+        key = json.dumps(request, sort_keys=True)
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{kind}-{name}{extension}")
+
+    def save(self, kind: str, request: dict, body: bytes):
+        filename = self.filename(kind, request, ".bin")
+        with open(filename + ".tmp", "wb") as file:
+            file.write(body)
+        os.replace(filename + ".tmp", filename)
+        # only written to see what was recorded
+        with open(self.filename(kind, request, ".json"), "w") as file:
+            file.write(json.dumps({"kind": kind, "request": request}, indent=4))
+
+    def load(self, kind: str, request: dict) -> bytes:
+        filename = self.filename(kind, request, ".bin")
+        if not os.path.exists(filename):
+            raise Exception(f"no recording of the {kind} request {request}")
+        with open(filename, "rb") as file:
+            return file.read()
+
+    def call(self, kind: str, request: dict, send: Callable[[], bytes]) -> bytes:
+        """Body of the response to request. send is only used when a real
+        request has to be made."""
+        if self.mode == "replay":
+            time.sleep(self.latency)
+            return self.load(kind, request)
+
+        body = send()
+        if self.mode == "record":
+            self.save(kind, request, body)
+        return body
+
+    async def call_async(
+        self, kind: str, request: dict, send: Callable[[], Awaitable[bytes]]
+    ) -> bytes:
+        if self.mode == "replay":
+            await asyncio.sleep(self.latency)
+            return self.load(kind, request)
+
+        body = await send()
+        if self.mode == "record":
+            self.save(kind, request, body)
+        return body
+
+
+transport = Transport(
+    config.http_transport_mode, config.http_cassette_dir, config.http_replay_latency
+)
@@ -0,0 +1,164 @@
+import hashlib
+from io import BytesIO
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from PIL import Image
+from configuration import Configuration
+from http_transport import transport
+from instrumentation import count_api_call
+
+config = Configuration()
+
+
+class IconCacheEntry:
+    def __init__(
+        self,
+        url: str,
+        fetched: float,
+        etag: str | None,
+        last_modified: str | None,
+    ) -> None:
+        self.url = url
+        self.fetched = fetched
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def to_dict(self) -> dict:
+        return {
+            "url": self.url,
+            "fetched": self.fetched,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+        }
+
+
+class SubredditIconCache:
+    """Subreddit icons keyed by their url, stored on disk already converted
+    and resized. After ttl seconds an icon is revalidated with its ETag or
+    Last-Modified header, and the stored copy is used when that fails."""
+
+    def __init__(
+        self, directory: str | None, ttl: float, timeout: float, size: int
+    ) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self.timeout = timeout
+        self.size = size
+
+        if directory != None:
+            os.makedirs(directory, exist_ok=True)
+
+    def filename(self, url: str, extension: str) -> str:
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key + extension)  # type: ignore
+
+    def load_entry(self, url: str) -> IconCacheEntry | None:
+        if self.directory == None:
+            return None
+        if not os.path.exists(self.filename(url, ".json")) or not os.path.exists(
+            self.filename(url, ".png")
+        ):
+            return None
+        with open(self.filename(url, ".json"), "r") as file:
+            return IconCacheEntry(**json.loads(file.read()))
+
+    def load_icon(self, url: str) -> Image.Image:
+        with Image.open(self.filename(url, ".png")) as image:
+            icon = image.convert("RGBA")
+        if icon.size != (self.size, self.size):
+            icon = icon.resize((self.size, self.size))
+        return icon
+
+    def save_entry(self, entry: IconCacheEntry):
+        if self.directory == None:
+            return
+        filename = self.filename(entry.url, ".json")
+        with open(filename + ".tmp", "w") as file:
+            file.write(json.dumps(entry.to_dict()))
+        os.replace(filename + ".tmp", filename)
+
+    def save_icon(self, url: str, icon: Image.Image):
+        if self.directory == None:
+            return
+        filename = self.filename(url, ".png")
+        icon.save(filename + ".tmp", format="PNG")
+        os.replace(filename + ".tmp", filename)
+
+    def request(self, url: str, entry: IconCacheEntry | None) -> urllib.request.Request:
+        headers = {}
+        if entry != None and entry.etag != None:
+            headers["If-None-Match"] = entry.etag
+        if entry != None and entry.last_modified != None:
+            headers["If-Modified-Since"] = entry.last_modified
+        return urllib.request.Request(url, headers=headers)
+
+    def get(self, url: str) -> Image.Image | None:
+        if url == "":
+            return None
+
+        # recorded and replayed runs request every icon from the transport
+        entry = self.load_entry(url) if transport.live else None
+        if entry != None and time.time() - entry.fetched < self.ttl:
+            return self.load_icon(url)
+
+        headers: dict[str, str | None] = {}
+
+        def send() -> bytes:
+            count_api_call("subreddit_icon")
+            with urllib.request.urlopen(
+                self.request(url, entry), timeout=self.timeout
+            ) as response:
+                headers["ETag"] = response.headers.get("ETag")
+                headers["Last-Modified"] = response.headers.get("Last-Modified")
+                return response.read()
+
+        def icon_from(body: bytes) -> Image.Image:
+            with Image.open(BytesIO(body)) as image:
+                return image.convert("RGBA").resize((self.size, self.size))
+
+        if not transport.live:
+            # recorded and replayed icons stay out of the cache. a recording
+            # that is missing is an error of the run, not something to retry
+            return icon_from(transport.call("subreddit_icon", {"url": url}, send))
+
+        # with a stored copy to fall back to a single attempt is enough
+        attempts = 1 if entry != None else 5
+        print(f"trying to request subreddit icon")
+        for i in range(0, attempts):
+            try:
+                icon = icon_from(transport.call("subreddit_icon", {"url": url}, send))
+
+                self.save_icon(url, icon)
+                self.save_entry(
+                    IconCacheEntry(
+                        url,
+                        time.time(),
+                        headers.get("ETag"),
+                        headers.get("Last-Modified"),
+                    )
+                )
+                return icon
+            except urllib.error.HTTPError as e:
+                if e.code == 304 and entry != None:
+                    entry.fetched = time.time()
+                    self.save_entry(entry)
+                    return self.load_icon(url)
+                print(f"retrying attempt {i}")
+            except Exception:
+                print(f"retrying attempt {i}")
+
+        if entry != None:
+            print("could not revalidate subreddit icon. using cached copy.")
+            return self.load_icon(url)
+        return None
+
+
+subreddit_icon_cache = SubredditIconCache(
+    config.thumbnail_icon_cache_dir,
+    config.thumbnail_icon_cache_ttl,
+    config.thumbnail_icon_request_timeout,
+    config.thumbnail_subreddit_icon_size,
+)
@@ -0,0 +1,188 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import datetime
+import json
+import os
+import sys
+import time
+from configuration import Configuration
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+config = Configuration()
+
+
+def process_peak_rss_bytes() -> int | None:
+    """Highest memory use of the whole process since it started, not of a
+    single stage."""
+    if resource != None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macos, kilobytes everywhere else
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+    if psutil != None:
+        memory_info = psutil.Process().memory_info()
+        return getattr(memory_info, "peak_wset", memory_info.rss)
+    return None
+
+
+def io_bytes() -> tuple[int, int] | None:
+    if psutil == None or not hasattr(psutil.Process, "io_counters"):
+        return None
+    counters = psutil.Process().io_counters()
+    return (counters.read_bytes, counters.write_bytes)
+
+
+def cpu_seconds() -> float:
+    # includes finished subprocesses like ffmpeg and mfa where supported
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+
+class Span:
+    """Measurements of one pipeline stage. Entering a stage with the same name
+    under the same parent again adds to the existing span."""
+
+    def __init__(self, name: str, parent: "Span | None" = None) -> None:
+        self.name = name
+        self.parent = parent
+        self.count = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.process_peak_rss: int | None = None
+        self.read_bytes: int | None = None
+        self.written_bytes: int | None = None
+        self.api_calls: dict[str, int] = {}
+        self.children: dict[str, Span] = {}
+
+    def child(self, name: str) -> "Span":
+        if name not in self.children:
+            self.children[name] = Span(name, self)
+        return self.children[name]
+
+    def count_api_call(self, api: str):
+        self.api_calls[api] = self.api_calls.get(api, 0) + 1
+        if self.parent != None:
+            self.parent.count_api_call(api)
+
+    def add_io(self, read_bytes: int, written_bytes: int):
+        self.read_bytes = (self.read_bytes or 0) + read_bytes
+        self.written_bytes = (self.written_bytes or 0) + written_bytes
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "count": self.count,
+            "wall_time": round(self.wall_time, 4),
+            "cpu_time": round(self.cpu_time, 4),
+            "process_peak_rss": self.process_peak_rss,
+            "read_bytes": self.read_bytes,
+            "written_bytes": self.written_bytes,
+            "api_calls": self.api_calls,
+            "children": [child.to_dict() for child in self.children.values()],
+        }
+
+    def flatten(self, prefix: str = "") -> dict[str, dict]:
+        path = prefix + self.name
+        values = self.to_dict()
+        del values["name"], values["children"]
+        stages = {path: values}
+        for child in self.children.values():
+            stages.update(child.flatten(path + "/"))
+        return stages
+
+
+__current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name: str):
+    parent = __current_span.get()
+    current = parent.child(name) if parent != None else Span(name)
+    token = __current_span.set(current)
+
+    start_wall = time.perf_counter()
+    start_cpu = cpu_seconds()
+    start_io = io_bytes()
+    try:
+        yield current
+    finally:
+        current.count += 1
+        current.wall_time += time.perf_counter() - start_wall
+        current.cpu_time += cpu_seconds() - start_cpu
+
+        end_io = io_bytes()
+        if start_io != None and end_io != None:
+            current.add_io(end_io[0] - start_io[0], end_io[1] - start_io[1])
+
+        # the peak of the process only grows, so this is the peak so far
+        current.process_peak_rss = process_peak_rss_bytes()
+
+        __current_span.reset(token)
+
+
+def count_api_call(api: str):
+    """Counts the call on the current span and all of its parents."""
+    current = __current_span.get()
+    if current != None:
+        current.count_api_call(api)
+
+
+def write_report(root: Span, filename: str, **metadata):
+    report = {
+        "created": datetime.datetime.now().isoformat(),
+        **metadata,
+        "stages": root.to_dict(),
+    }
+    with open(filename, "w") as file:
+        file.write(json.dumps(report, indent=4))
+
+    if config.instrumentation_summary_file != None:
+        with open(config.instrumentation_summary_file, "a") as file:
+            file.write(json.dumps({**metadata, "stages": root.flatten()}) + "\n")
+
+
+def summarize_reports(summary_file: str) -> dict[str, dict]:
+    totals: dict[str, dict] = {}
+    with open(summary_file, "r") as file:
+        for line in file.readlines():
+            for stage, values in json.loads(line)["stages"].items():
+                total = totals.setdefault(
+                    stage,
+                    {
+                        "runs": 0,
+                        "wall_time": 0.0,
+                        "cpu_time": 0.0,
+                        "max_process_peak_rss": 0,
+                    },
+                )
+                total["runs"] += 1
+                total["wall_time"] += values["wall_time"]
+                total["cpu_time"] += values["cpu_time"]
+                # summaries written before the rename call it peak_rss
+                peak = values.get("process_peak_rss", values.get("peak_rss"))
+                total["max_process_peak_rss"] = max(
+                    total["max_process_peak_rss"], peak or 0
+                )
+
+    for total in totals.values():
+        total["mean_wall_time"] = total["wall_time"] / total["runs"]
+        total["mean_cpu_time"] = total["cpu_time"] / total["runs"]
+    return totals
+
+
+if __name__ == "__main__":
+    if config.instrumentation_summary_file == None:
+        print("instrumentation_summary_file is not set, there are no runs to summarize")
+        sys.exit(0)
+    for stage, total in summarize_reports(config.instrumentation_summary_file).items():
+        print(
+            f"{stage}: {total['runs']} runs, {total['mean_wall_time']:.2f}s wall, {total['mean_cpu_time']:.2f}s cpu on average"
+        )
@@ -0,0 +1,159 @@
+import html
+import re
+from typing import Iterable, Iterator
+
+# blocks are recognized line by line
+fence = re.compile(r"^ {0,3}(```|~~~)")
+heading = re.compile(r"^ {0,3}#{1,6}\s*(.*?)\s*#*\s*$")
+setext_underline = re.compile(r"^ {0,3}(=+|-+)\s*$")
+rule = re.compile(r"^ {0,3}([-*_])(?: *\1){2,} *$")
+quote = re.compile(r"^ {0,3}>(?!!) ?")
+list_item = re.compile(r"^\s*(?:[*+-]|\d+\.)\s+(.*)$")
+indented = re.compile(r"^(?: {4}|\t)")
+
+inline = re.compile(
+    r"\\(?P<escaped>[\\`*_{}\[\]()#+\-.!>~^|])"
+    r"|(?P<ticks>`+)(?P<code>.+?)(?P=ticks)"
+    r"|!\[[^\]]*\]\((?:[^()]|\([^()]*\))*\)"
+    r"|\[(?P<link>[^\]]+)\]\((?:[^()\s]|\([^()\s]*\))*(?:\s+\"[^\"]*\")?\)"
+    r"|<(?P<url>(?:https?|ftp)://[^>\s]+)>"
+    r"|>!(?P<spoiler>.+?)!<"
+    r"|~~(?P<strike>(?=\S).+?(?<=\S))~~"
+    r"|(?P<stars>\*{1,3})(?P<starred>(?=\S).+?(?<=\S))(?P=stars)"
+    r"|(?<!\w)(?P<underscores>_{1,3})(?P<underscored>(?=\S).+?(?<=\S))(?P=underscores)(?!\w)"
+    r"|\^\((?P<raised>[^)]*)\)"
+    r"|\^(?=\S)",
+    re.DOTALL,
+)
+
+# reddit sends these as entities, e.g. &amp;#x200B; for an empty paragraph
+invisible = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+
+
+def unescape(line: str) -> str:
+    # reddit escapes &, < and > once more on top of what the author wrote
+    line = line.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+    line = html.unescape(line)
+    return invisible.sub("", line.replace("\xa0", " "))
+
+
+def inline_text(text: str) -> str:
+    """The text without emphasis, links, code and spoiler markup."""
+
+    def replace(match: re.Match) -> str:
+        if match.group("escaped") != None:
+            return match.group("escaped")
+        if match.group("code") != None:
+            return match.group("code").strip()
+        for group in ["link", "spoiler", "strike", "starred", "underscored"]:
+            if match.group(group) != None:
+                return inline_text(match.group(group))
+        if match.group("url") != None:
+            return match.group("url")
+        if match.group("raised") != None:
+            return inline_text(match.group("raised"))
+        # images and the caret of superscript
+        return ""
+
+    return inline.sub(replace, text)
+
+
+def paragraph_line(line: str) -> str:
+    # two spaces at the end of a line mark a line break and are dropped
+    if line.endswith("  "):
+        return line.rstrip()
+    return line
+
+
+def narration_lines(lines: Iterable[str]) -> Iterator[str]:
+    """Plain text of markdown lines, yielded block by block as soon as a
+    block is complete. Blocks end with a newline, lists and quotes are
+    surrounded by an empty line, like the output of the markdown package
+    this replaces. Nothing is shared between calls, so any number of them
+    can run at once."""
+    paragraph: list[str] = []
+    container: str | None = None
+    in_fence: str | None = None
+    in_code = False
+    previous_blank = True
+
+    def end_paragraph() -> Iterator[str]:
+        if len(paragraph) > 0:
+            yield inline_text("\n".join(paragraph).strip()) + "\n"
+            paragraph.clear()
+
+    def enter(kind: str | None) -> Iterator[str]:
+        nonlocal container
+        yield from end_paragraph()
+        if kind != container:
+            # code blocks are only followed by an empty line
+            if container != None:
+                yield "\n"
+            if kind != None and kind != "code":
+                yield "\n"
+            container = kind
+
+    for line in lines:
+        line = unescape(line.rstrip("\r"))
+
+        if in_fence != None:
+            if line.strip().startswith(in_fence):
+                in_fence = None
+            else:
+                yield line + "\n"
+            continue
+
+        if line.strip() == "":
+            yield from end_paragraph()
+            previous_blank = True
+            continue
+
+        # indented lines in a list belong to its items instead
+        if (
+            indented.match(line) != None
+            and (previous_blank or in_code)
+            and container != "list"
+        ):
+            yield from enter("code")
+            yield indented.sub("", line, count=1) + "\n"
+            in_code = True
+            previous_blank = False
+            continue
+        in_code = False
+
+        if quote.match(line) != None:
+            if container != "quote":
+                yield from enter("quote")
+            while quote.match(line) != None:
+                line = quote.sub("", line, count=1)
+            if line.strip() == "":
+                yield from end_paragraph()
+            else:
+                paragraph.append(paragraph_line(line))
+        elif fence.match(line) != None:
+            yield from enter("code")
+            in_fence = fence.match(line).group(1)  # type: ignore
+        elif rule.match(line) != None and len(paragraph) == 0:
+            yield from enter(None)
+        elif setext_underline.match(line) != None and len(paragraph) > 0:
+            # turns the paragraph above into a heading
+            yield from end_paragraph()
+        elif heading.match(line) != None:
+            yield from enter(None)
+            yield inline_text(heading.match(line).group(1) or "") + "\n"  # type: ignore
+        elif list_item.match(line) != None and (previous_blank or container == "list"):
+            if container != "list":
+                yield from enter("list")
+            yield from end_paragraph()
+            paragraph.append(paragraph_line(list_item.match(line).group(1)))  # type: ignore
+        else:
+            if container == "code" or (container != None and previous_blank):
+                yield from enter(None)
+            paragraph.append(paragraph_line(line))
+        previous_blank = False
+
+    yield from enter(None)
+
+
+def markdown_to_narration(text: str) -> str:
+    return "".join(narration_lines(text.split("\n"))).strip()
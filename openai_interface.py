@@ -1,5 +1,6 @@
 from argparse import FileType
 import json
+import os
 from pathlib import Path
 import time
 from typing import Literal
@@ -9,8 +10,10 @@ from PIL import Image
 from io import BytesIO
 import base64
 from configuration import Configuration
+from http_transport import transport
 
-from text_processing import split_text_to_max_x_chars
+from instrumentation import count_api_call, span
+from text_processing import text_chunks
 
 
 class OpenAiInterface:
@@ -70,41 +73,67 @@ class OpenAiInterface:
         text: str,
         filepath: str,
     ):
-        filename = filepath[: filepath.index(".")]
-        ext = filepath[filepath.index(".") + 1 :]
+        with span("tts"):
+            filename, ext = os.path.splitext(filepath)
+            # only complete files ever appear under filepath
+            tmp_file = f"{filename}.tmp{ext}"
 
-        text_segments: list[str] = split_text_to_max_x_chars(text, 4096)
+            text_segments: list[str] = list(text_chunks(text, 4096))
 
-        if len(text_segments) < 2:
-            response = self.client.audio.speech.create(
+            if len(text_segments) < 2:
+                with open(tmp_file, "wb") as file:
+                    file.write(self.speech(text))
+            else:
+                print(
+                    f"audio is too long for openai. requesting {len(text_segments)} audio files"
+                )
+
+                audio_files: list[AudioClip] = []
+                for index, text_segment in enumerate(text_segments):
+                    print(f"requesting audio file {index}")
+
+                    tmp_file_name: str = filename + "-" + str(index) + ".mp3"
+                    with open(tmp_file_name, "wb") as file:
+                        file.write(self.speech(text_segment))
+                    audio_files.append(AudioFileClip(tmp_file_name))
+
+                print(f"combining audio files")
+                combined_audio: AudioClip = concatenate_audioclips(audio_files)
+                combined_audio.write_audiofile(tmp_file)
+            os.replace(tmp_file, filepath)
+
+    def speech(self, text: str) -> bytes:
+        """Mp3 of the text spoken by the configured voice."""
+        request = {
+            "input": text,
+            "model": self.config.audio_model,
+            "voice": self.config.audio_voice,
+        }
+
+        def send() -> bytes:
+            count_api_call("openai_tts")
+            return self.client.audio.speech.create(
                 input=text,
                 model=self.config.audio_model,
                 voice=self.config.audio_voice,
                 response_format="mp3",
-            )
-            response.stream_to_file(filename + ".mp3")
-        else:
-            print(
-                f"audio is too long for openai. requesting {len(text_segments)} audio files"
-            )
+            ).content
 
-            audio_files: list[AudioClip] = []
-            for index, text_segment in enumerate(text_segments):
-                print(f"requesting audio file {index}")
+        return transport.call("openai_tts", request, send)
 
-                response = self.client.audio.speech.create(
-                    input=text_segment,
-                    model=self.config.audio_model,
-                    voice=self.config.audio_voice,
-                )
+    def chat(self, messages: list[dict]) -> str | None:
+        request = {"messages": messages, "model": "gpt-4-1106-preview"}
 
-                tmp_file_name: str = filename + "-" + str(index) + ".mp3"
-                response.stream_to_file(tmp_file_name)
-                audio_files.append(AudioFileClip(tmp_file_name))
+        def send() -> bytes:
+            count_api_call("openai_chat")
+            chat_completion = self.client.chat.completions.create(
+                messages=messages,  # type: ignore
+                model="gpt-4-1106-preview",
+            )
+            content = chat_completion.choices[0].message.content
+            return json.dumps({"content": content}).encode("utf-8")
 
-            print(f"combining audio files")
-            combined_audio: AudioClip = concatenate_audioclips(audio_files)
-            combined_audio.write_audiofile(filepath)
+        return json.loads(transport.call("openai_chat", request, send))["content"]
 
     def generate_text_with_context(self, text: str, tries=5) -> str:
         if len(self.msg) == 0:
@@ -117,19 +146,16 @@ class OpenAiInterface:
                 )
         self.msg.append({"role": "user", "content": text})
 
-        chat_completion = self.client.chat.completions.create(
-            messages=self.msg,  # type: ignore
-            model="gpt-4-1106-preview",
-        )
+        content = self.chat(self.msg)
 
-        if isinstance(chat_completion.choices[0].message.content, str):
+        if isinstance(content, str):
             self.msg.append(
                 {
                     "role": "assistant",
-                    "content": chat_completion.choices[0].message.content,
+                    "content": content,
                 }
             )
-            return chat_completion.choices[0].message.content
+            return content
         else:
             print(f"openai text generation error. retries left: {tries}")
             if tries > 0:
@@ -143,19 +169,18 @@ class OpenAiInterface:
     def generate_text_without_context(
         self, system_prompt: str, text: str, tries=5
     ) -> str:
-        chat_completion = self.client.chat.completions.create(
-            messages=[
+        content = self.chat(
+            [
                 {
                     "role": "system",
                     "content": system_prompt,
                 },
                 {"role": "user", "content": text},
-            ],
-            model="gpt-4-1106-preview",
+            ]
         )
 
-        if isinstance(chat_completion.choices[0].message.content, str):
-            return chat_completion.choices[0].message.content
+        if isinstance(content, str):
+            return content
         else:
             print(f"openai text generation error. retries left: {tries}")
             if tries > 0:
@@ -0,0 +1,142 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import subprocess
+from typing import Tuple
+from moviepy import VideoFileClip
+from caption_compositor import CaptionTrack, composite_captions
+from configuration import Configuration
+from ffmpeg_renderer import audio_mix_filters
+from render_timeline import SavedCaption, Timeline
+from video_utils import crop_to_center_and_resize
+
+config = Configuration()
+
+
+def split_into_chunks(
+    duration: float, num_chunks: int, fps: int
+) -> list[Tuple[float, float]]:
+    # chunk borders fall on frame borders so that no frame is rendered twice
+    total_frames = round(duration * fps)
+    borders = [round(total_frames * i / num_chunks) for i in range(num_chunks + 1)]
+    return [
+        (borders[i] / fps, borders[i + 1] / fps)
+        for i in range(num_chunks)
+        if borders[i] < borders[i + 1]
+    ]
+
+
+def captions_in_chunk(
+    captions: list[SavedCaption], start_time: float, end_time: float
+) -> list[SavedCaption]:
+    return [
+        SavedCaption(
+            caption.filename, caption.start - start_time, caption.end - start_time
+        )
+        for caption in captions
+        if caption.end >= start_time and caption.start < end_time
+    ]
+
+
+def render_chunk(
+    background_filename: str,
+    start_time: float,
+    end_time: float,
+    resolution: Tuple[int, int],
+    captions: list[SavedCaption],
+    filename: str,
+    threads: int,
+):
+    clip = VideoFileClip(background_filename, audio=False)
+    background = clip.subclip(start_time, end_time)
+    background = crop_to_center_and_resize(background, resolution)
+
+    video = composite_captions(background, CaptionTrack(captions, resolution))
+    video.write_videofile(
+        filename,
+        fps=config.video_fps,
+        threads=threads,
+        preset=config.write_video_preset,
+        audio=False,
+        logger=None,
+    )
+    clip.close()
+
+
+def render_timeline_in_parallel(timeline: Timeline, filename: str, tmp_prefix: str):
+    """Renders the timeline in time ranges, each in its own process. Every
+    range starts with a keyframe, so they can be joined without re-encoding."""
+    if timeline.background == None or timeline.narration_audio == None:
+        raise Exception("Timeline is missing background video or narration audio")
+
+    captions = timeline.save_captions(tmp_prefix)
+    chunks = split_into_chunks(
+        timeline.duration, config.render_workers, config.video_fps
+    )
+    threads = max(1, config.num_threads // len(chunks))
+    chunk_files = [
+        os.path.abspath(f"{tmp_prefix}-chunk-{index}.mp4")
+        for index in range(len(chunks))
+    ]
+
+    print(f"rendering {len(chunks)} chunks in parallel")
+    with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+        futures = [
+            executor.submit(
+                render_chunk,
+                timeline.background.filename,
+                timeline.background.start_time + start_time,
+                timeline.background.start_time + end_time,
+                timeline.resolution,
+                captions_in_chunk(captions, start_time, end_time),
+                chunk_files[index],
+                threads,
+            )
+            for index, (start_time, end_time) in enumerate(chunks)
+        ]
+        for future in futures:
+            future.result()
+
+    concat_list = f"{tmp_prefix}-chunks.txt"
+    with open(concat_list, "w") as file:
+        for chunk_file in chunk_files:
+            escaped = chunk_file.replace("'", "'\\''")
+            file.write(f"file '{escaped}'\n")
+
+    command = [
+        "ffmpeg",
+        "-y",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        concat_list,
+        "-i",
+        timeline.narration_audio,
+        "-ss",
+        f"{timeline.background.start_time:.3f}",
+        "-t",
+        f"{timeline.duration:.3f}",
+        "-i",
+        timeline.background.filename,
+        "-filter_complex",
+        ";".join(audio_mix_filters(1, 2, timeline.background.has_audio)),
+        "-map",
+        "0:v",
+        "-map",
+        "[aout]",
+        "-c:v",
+        "copy",
+        "-c:a",
+        "aac",
+        "-t",
+        f"{timeline.duration:.3f}",
+        filename,
+    ]
+
+    print(f"joining chunks and muxing audio into {filename}")
+    result = subprocess.run(command)
+    try:
+        result.check_returncode()
+    except subprocess.CalledProcessError:
+        raise Exception("joining rendered chunks failed")
@@ -0,0 +1,249 @@
+import argparse
+from datetime import timedelta
+import json
+import sqlite3
+import threading
+import time
+from typing import Iterator
+from configuration import Configuration
+from posted_registry import posted_registry
+from reddit_requests import Post, search_subreddits
+from video_utils import CHARS_PER_SECOND, duration_bounds, is_update_title
+
+config = Configuration()
+
+
+def ranking_score(post: Post) -> float:
+    # awards and long discussions mark the stories people liked most
+    return post.score + 100 * post.gilded + 2 * post.num_comments
+
+
+class PostStore:
+    """Every post seen in a subreddit listing, with the duration of its text,
+    whether it can be used at all and how good it is worked out once when
+    it is added. Finding the best post for a video is a query on top."""
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.posted_ids: set[str] | None = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Connection of the current thread, opened the first time the thread
+        needs one. Sqlite connections can not be shared between threads."""
+        connection = getattr(self.local, "connection", None)
+        if connection == None:
+            connection = sqlite3.connect(self.filename)
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS posts (
+                    post_id TEXT PRIMARY KEY,
+                    subreddit TEXT NOT NULL COLLATE NOCASE,
+                    title TEXT NOT NULL,
+                    selftext TEXT NOT NULL,
+                    duration REAL NOT NULL,
+                    nsfw INTEGER NOT NULL,
+                    is_update INTEGER NOT NULL,
+                    score INTEGER NOT NULL,
+                    gilded INTEGER NOT NULL,
+                    num_comments INTEGER NOT NULL,
+                    rank REAL NOT NULL,
+                    fetched REAL NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS posts_by_rank
+                    ON posts (nsfw, is_update, rank DESC);
+                CREATE INDEX IF NOT EXISTS posts_by_duration
+                    ON posts (nsfw, is_update, duration);
+                CREATE TABLE IF NOT EXISTS posted (
+                    post_id TEXT PRIMARY KEY
+                );
+                CREATE TABLE IF NOT EXISTS listed (
+                    listing TEXT NOT NULL,
+                    timeframe TEXT NOT NULL,
+                    post_id TEXT NOT NULL,
+                    fetched REAL NOT NULL,
+                    PRIMARY KEY (listing, timeframe, post_id)
+                );
+                """)
+            self.local.connection = connection
+        return connection
+
+    def add_posts(self, posts: list[Post], listing: str, timeframe: str):
+        """Stores the posts and that they were just seen in the listing of
+        the timeframe. Posts that are already known get their current score
+        and text."""
+        fetched = time.time()
+        self.connection.executemany(
+            """
+            INSERT INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (post_id) DO UPDATE SET
+                title = excluded.title,
+                selftext = excluded.selftext,
+                duration = excluded.duration,
+                nsfw = excluded.nsfw,
+                is_update = excluded.is_update,
+                score = excluded.score,
+                gilded = excluded.gilded,
+                num_comments = excluded.num_comments,
+                rank = excluded.rank,
+                fetched = excluded.fetched,
+                data = excluded.data
+            """,
+            [
+                (
+                    post.post_id,
+                    post.subreddit,
+                    post.title,
+                    post.selftext,
+                    len(post.selftext) / CHARS_PER_SECOND,
+                    post.nsfw,
+                    is_update_title(post.title),
+                    post.score,
+                    post.gilded,
+                    post.num_comments,
+                    ranking_score(post),
+                    fetched,
+                    json.dumps(post.data),
+                )
+                for post in posts
+            ],
+        )
+        self.connection.executemany(
+            """
+            INSERT INTO listed VALUES (?, ?, ?, ?)
+            ON CONFLICT (listing, timeframe, post_id) DO UPDATE SET
+                fetched = excluded.fetched
+            """,
+            [(listing, timeframe, post.post_id, fetched) for post in posts],
+        )
+        self.connection.commit()
+
+    def sync_posted(self, posted_ids: set[str]):
+        """Copies the posted registry into the posted table, so that queries
+        can leave out posts that were already turned into videos."""
+        with self.lock:
+            if self.posted_ids == None:
+                self.posted_ids = {
+                    post_id
+                    for (post_id,) in self.connection.execute(
+                        "SELECT post_id FROM posted"
+                    )
+                }
+            added = posted_ids - self.posted_ids
+            removed = self.posted_ids - posted_ids
+            if len(added) == 0 and len(removed) == 0:
+                return
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO posted VALUES (?)", [(id,) for id in added]
+            )
+            self.connection.executemany(
+                "DELETE FROM posted WHERE post_id = ?", [(id,) for id in removed]
+            )
+            self.connection.commit()
+            self.posted_ids = set(posted_ids)
+
+    def candidates(
+        self,
+        subreddits: list[str],
+        listing: str,
+        timeframe: str,
+        min_duration: timedelta | None = None,
+        max_duration: timedelta | None = None,
+        limit: int | None = None,
+    ) -> Iterator[Post]:
+        """Usable posts of the subreddits that were not posted yet, from best
+        to worst. Only posts seen in the listing of the timeframe within the
+        last post_store_max_age seconds count, a post from an old top/all
+        listing is no hot post of the day."""
+        self.sync_posted(posted_registry.all_ids())
+        query = f"""
+            SELECT selftext, data FROM posts
+            WHERE nsfw = 0 AND is_update = 0
+            AND subreddit IN ({", ".join("?" * len(subreddits))})
+            AND NOT EXISTS (
+                SELECT 1 FROM posted WHERE posted.post_id = posts.post_id
+            )
+            AND EXISTS (
+                SELECT 1 FROM listed
+                WHERE listed.post_id = posts.post_id
+                AND listing = ? AND timeframe = ? AND listed.fetched >= ?
+            )
+        """
+        parameters: list = list(subreddits) + [
+            listing,
+            timeframe,
+            time.time() - config.post_store_max_age,
+        ]
+        if min_duration != None:
+            query += " AND duration >= ?"
+            parameters.append(min_duration.total_seconds())
+        if max_duration != None:
+            query += " AND duration <= ?"
+            parameters.append(max_duration.total_seconds())
+        query += " ORDER BY rank DESC, post_id"
+        if limit != None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+
+        for selftext, data in self.connection.execute(query, parameters):
+            yield Post(json.loads(data), cleaned_selftext=selftext)
+
+    def plan(
+        self,
+        subreddits: list[str],
+        listing: str,
+        timeframe: str,
+        count: int,
+        min_duration: timedelta | None = None,
+        max_duration: timedelta | None = None,
+    ) -> list[Post]:
+        """The next count posts that would be selected, best first."""
+        return list(
+            self.candidates(
+                subreddits, listing, timeframe, min_duration, max_duration, count
+            )
+        )
+
+
+post_store = PostStore(config.post_store_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="list the next posts that would be turned into videos"
+    )
+    parser.add_argument("category", help="key in config/reddit_threads.json")
+    parser.add_argument("--count", type=int, default=7)
+    parser.add_argument("--min-minutes", type=float)
+    parser.add_argument("--max-minutes", type=float)
+    parser.add_argument("--approx-minutes", type=float)
+    parser.add_argument("--listing", default="top")
+    parser.add_argument("--timeframe", default="week")
+    args = parser.parse_args()
+
+    with open("config/reddit_threads.json") as file:
+        subreddits = json.loads(file.read())[args.category]
+    post_store.add_posts(
+        search_subreddits(subreddits, args.listing, args.timeframe),
+        args.listing,
+        args.timeframe,
+    )
+
+    min_duration, max_duration = duration_bounds(
+        None if args.approx_minutes == None else timedelta(minutes=args.approx_minutes),
+        None if args.min_minutes == None else timedelta(minutes=args.min_minutes),
+        None if args.max_minutes == None else timedelta(minutes=args.max_minutes),
+    )
+    for post in post_store.plan(
+        subreddits,
+        args.listing,
+        args.timeframe,
+        args.count,
+        min_duration,
+        max_duration,
+    ):
+        print(
+            f"{post.post_id} r/{post.subreddit} {len(post.selftext) / CHARS_PER_SECOND / 60:.1f}min score {post.score}: {post.title}"
+        )
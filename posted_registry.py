@@ -0,0 +1,107 @@
+from contextlib import contextmanager
+import os
+from configuration import Configuration
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+config = Configuration()
+
+
+class PostedRegistry:
+    """Ids of the posts that were already turned into videos, one per line.
+    The file is only ever appended to while holding a lock, so several
+    generator processes can share it. Every process keeps the ids in a set
+    and only reads what the others appended since it last looked."""
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.ids: set[str] = set()
+        self.offset = 0
+        self.ends_with_newline = True
+
+    @contextmanager
+    def locked(self):
+        with open(self.filename + ".lock", "a+b") as lock_file:
+            if fcntl != None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            elif msvcrt != None:
+                lock_file.seek(0)
+                # LK_LOCK only waits about ten seconds before giving up
+                while True:
+                    try:
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+            try:
+                yield
+            finally:
+                if fcntl != None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                elif msvcrt != None:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def refresh(self, complete: bool = False):
+        # without the lock the last line might still be being written, so it
+        # is only read once it ends with a newline
+        if not os.path.exists(self.filename):
+            return
+        size = os.path.getsize(self.filename)
+        if size < self.offset:
+            # the file was replaced, start over
+            self.ids.clear()
+            self.offset = 0
+        if size == self.offset:
+            return
+
+        with open(self.filename, "rb") as file:
+            file.seek(self.offset)
+            data = file.read()
+        end = len(data) if complete else data.rfind(b"\n") + 1
+
+        for line in data[:end].decode("utf-8").splitlines():
+            if line.strip() != "":
+                self.ids.add(line.strip())
+        self.offset += end
+        if end > 0:
+            self.ends_with_newline = data[end - 1 : end] == b"\n"
+
+    def __contains__(self, post_id: str) -> bool:
+        self.refresh()
+        return post_id in self.ids
+
+    def claim(self, post_id: str) -> bool:
+        """Adds the id unless it is already registered. Returns whether this
+        call added it, so only one process ever gets True for an id."""
+        with self.locked():
+            self.refresh(complete=True)
+            if post_id in self.ids:
+                return False
+
+            line = post_id + "\n"
+            if not self.ends_with_newline:
+                line = "\n" + line
+            with open(self.filename, "ab") as file:
+                file.write(line.encode("utf-8"))
+                file.flush()
+                os.fsync(file.fileno())
+                self.offset = file.tell()
+            self.ids.add(post_id)
+            self.ends_with_newline = True
+            return True
+
+    def all_ids(self) -> set[str]:
+        self.refresh()
+        return set(self.ids)
+
+
+posted_registry = PostedRegistry(config.already_posted_file)
@@ -0,0 +1,242 @@
+import asyncio
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+import time
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from configuration import Configuration
+from http_transport import transport
+from instrumentation import count_api_call
+from request_scheduler import PRIORITY_JOB, RETRY_STATUS_CODES, RequestScheduler
+
+config = Configuration()
+
+
+class RedditClient:
+    """One pooled connection to reddit for the whole process. Json responses
+    are kept for ttl seconds, the most recently used ones in memory and all
+    of them optionally on disk, so repeated searches of the same listing do
+    not request it again. Every request goes through the scheduler and is
+    retried when reddit is throttling or unavailable."""
+
+    def __init__(
+        self,
+        directory: str | None,
+        ttl: float,
+        max_entries: int,
+        timeout: float,
+        max_concurrent: int,
+        user_agent: str,
+        scheduler: RequestScheduler,
+        max_retries: int,
+    ) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self.user_agent = user_agent
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+        self.entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self.last_eviction = 0.0
+        # the prefetch thread and the asyncio requests share the entries
+        self.lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers["User-agent"] = user_agent
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=max_concurrent))
+
+        if directory != None:
+            os.makedirs(directory, exist_ok=True)
+
+    def filename(self, url: str) -> str:
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key + ".json")  # type: ignore
+
+    def load_from_disk(self, url: str) -> tuple[float, object] | None:
+        if self.directory == None or not os.path.exists(self.filename(url)):
+            return None
+        with open(self.filename(url), "r") as file:
+            cached = json.loads(file.read())
+        return (cached["fetched"], cached["data"])
+
+    def save_to_disk(self, url: str, fetched: float, data: object):
+        if self.directory == None:
+            return
+        filename = self.filename(url)
+        with open(filename + ".tmp", "w") as file:
+            file.write(json.dumps({"url": url, "fetched": fetched, "data": data}))
+        os.replace(filename + ".tmp", filename)
+        self.remove_expired_from_disk()
+
+    def remove_expired_from_disk(self):
+        """Deletes responses older than ttl, and temporary files left behind
+        by a crash. Runs at most once per ttl, so the directory is not listed
+        on every request."""
+        now = time.time()
+        with self.lock:
+            if self.directory == None or now - self.last_eviction < self.ttl:
+                return
+            self.last_eviction = now
+
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith((".json", ".tmp")):
+                continue
+            try:
+                if now - entry.stat().st_mtime >= self.ttl:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # removed by another process in the meantime
+                pass
+
+    def remember(self, url: str, fetched: float, data: object):
+        with self.lock:
+            self.entries[url] = (fetched, data)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def cached(self, url: str) -> object | None:
+        with self.lock:
+            cached = self.entries.get(url)
+        if cached == None:
+            cached = self.load_from_disk(url)
+        if cached == None or time.time() - cached[0] >= self.ttl:
+            return None
+        self.remember(url, *cached)
+        return cached[1]
+
+    def store(self, url: str, data: object):
+        fetched = time.time()
+        self.remember(url, fetched, data)
+        self.save_to_disk(url, fetched, data)
+
+    def retry_delay(
+        self, attempt: int, error: Exception, status_code: int | None, headers
+    ) -> float:
+        if attempt >= self.max_retries:
+            raise error
+        retry_after = None if headers == None else headers.get("retry-after")
+        delay = self.scheduler.backoff(attempt, retry_after)
+        if status_code == 429:
+            self.scheduler.pause(delay)
+        # httpx adds a line with a link to its errors
+        message = str(error).splitlines()[0]
+        print(f"reddit request failed ({message}). retrying in {delay:.1f} seconds")
+        return delay
+
+    def get_json(self, url: str, cache: bool = True, priority: int = PRIORITY_JOB):
+        # recorded and replayed runs request everything from the transport
+        cache = cache and transport.live
+        if cache:
+            data = self.cached(url)
+            if data != None:
+                return data
+
+        data = json.loads(
+            transport.call("reddit", {"url": url}, lambda: self.download(url, priority))
+        )
+
+        if cache:
+            self.store(url, data)
+        return data
+
+    def download(self, url: str, priority: int) -> bytes:
+        attempt = 0
+        while True:
+            self.scheduler.acquire(priority)
+            count_api_call("reddit")
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                self.scheduler.update(response.headers)
+                response.raise_for_status()
+                return response.content
+            except requests.HTTPError as e:
+                if e.response.status_code not in RETRY_STATUS_CODES:
+                    raise
+                delay = self.retry_delay(
+                    attempt, e, e.response.status_code, e.response.headers
+                )
+            except requests.RequestException as e:
+                delay = self.retry_delay(attempt, e, None, None)
+            time.sleep(delay)
+            attempt += 1
+
+    def async_session(self) -> httpx.AsyncClient:
+        # an AsyncClient belongs to one event loop, so every run gets its own
+        return httpx.AsyncClient(
+            headers={"User-agent": self.user_agent},
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrent),
+        )
+
+    async def get_json_async(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        cache: bool = True,
+        priority: int = PRIORITY_JOB,
+    ):
+        cache = cache and transport.live
+        if cache:
+            data = self.cached(url)
+            if data != None:
+                return data
+
+        data = json.loads(
+            await transport.call_async(
+                "reddit",
+                {"url": url},
+                lambda: self.download_async(client, url, priority),
+            )
+        )
+
+        if cache:
+            self.store(url, data)
+        return data
+
+    async def download_async(
+        self, client: httpx.AsyncClient, url: str, priority: int
+    ) -> bytes:
+        attempt = 0
+        while True:
+            await self.scheduler.acquire_async(priority)
+            count_api_call("reddit")
+            try:
+                response = await client.get(url)
+                self.scheduler.update(response.headers)
+                response.raise_for_status()
+                return response.content
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in RETRY_STATUS_CODES:
+                    raise
+                delay = self.retry_delay(
+                    attempt, e, e.response.status_code, e.response.headers
+                )
+            except httpx.TransportError as e:
+                delay = self.retry_delay(attempt, e, None, None)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+reddit_client = RedditClient(
+    config.reddit_cache_dir,
+    config.reddit_cache_ttl,
+    config.reddit_cache_size,
+    config.reddit_request_timeout,
+    config.reddit_max_concurrent_requests,
+    config.reddit_user_agent,
+    RequestScheduler(
+        config.reddit_requests_per_minute,
+        config.reddit_max_concurrent_requests,
+        config.reddit_ratelimit_reserve,
+        config.reddit_backoff_base,
+        config.reddit_backoff_max,
+    ),
+    config.reddit_max_retries,
+)
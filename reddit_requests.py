@@ -1,19 +1,24 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from random import randrange
-from typing import Literal
-import requests
+from typing import Callable, Iterator, Literal, Tuple
+import httpx
 
+from reddit_client import reddit_client
+from request_scheduler import PRIORITY_JOB, PRIORITY_PREFETCH
 from text_processing import text_cleanup
 
-useragent = "yourbot"
-
-
+# the morechildren endpoint accepts at most this many ids per request
+MORECHILDREN_BATCH_SIZE = 100
 
 
 class PostSearch:
-    
-    #use "after" in json has a value like "t3_18v6czy". 
-    # to go to the next page and list another 100 posts add "&after=t3_18v6czy" to the url
-    
+    """Posts of a subreddit listing. By default the first page of 100 posts
+    is loaded into posts right away. With lazy=True nothing is requested
+    until iter_posts is used, which follows the "after" cursor of the
+    listing page by page."""
+
     def __init__(
         self,
         subreddit: str,
@@ -21,20 +26,130 @@ class PostSearch:
             "controversial", "best", "hot", "new", "random", "rising", "top"
         ],
         timeframe: Literal["day", "week", "month", "year", "all"],
+        lazy: bool = False,
     ) -> None:
+        self.subreddit = subreddit
+        self.listing = listing
+        self.timeframe = timeframe
+        self.posts: list[Post] = []
+        if lazy:
+            return
+
         try:
             print(f"Trying to access {listing} posts of {timeframe} from {subreddit}")
-            base_url = f"https://www.reddit.com/r/{subreddit}/{listing}.json?sr_detail=1&t={timeframe}&limit={100}"
-            print(base_url)
-            request = requests.get(base_url, headers={"User-agent": useragent})
-            posts_listing = request.json()
-            
+            self.posts, _ = self.load_page(None)
+        except Exception as e:
+            print(f"an error occured while searching for posts: {e}")
+
+    def page_url(self, after: str | None) -> str:
+        url = f"https://www.reddit.com/r/{self.subreddit}/{self.listing}.json?sr_detail=1&t={self.timeframe}&limit={100}"
+        if after != None:
+            url += f"&after={after}"
+        return url
+
+    def load_page(
+        self, after: str | None, priority: int = PRIORITY_JOB
+    ) -> Tuple[list["Post"], str | None]:
+        base_url = self.page_url(after)
+        print(base_url)
+        # random listings must not be answered from the cache
+        posts_listing = reddit_client.get_json(
+            base_url, cache=self.listing != "random", priority=priority
+        )
+        return self.parse_page(posts_listing)
+
+    async def load_page_async(
+        self,
+        client: httpx.AsyncClient,
+        after: str | None,
+        priority: int = PRIORITY_JOB,
+    ) -> Tuple[list["Post"], str | None]:
+        base_url = self.page_url(after)
+        print(base_url)
+        posts_listing = await reddit_client.get_json_async(
+            client, base_url, cache=self.listing != "random", priority=priority
+        )
+        return self.parse_page(posts_listing)
+
+    def parse_page(self, posts_listing) -> Tuple[list["Post"], str | None]:
+        posts = [Post(post) for post in get_parameter(posts_listing, "children")]
+        return posts, get_parameter(posts_listing, "after")
 
-            self.posts: list[Post] = []
-            for post in get_parameter(posts_listing, "children"):
-                self.posts.append(Post(post))
-        except:
-            print("an error occured while searching for posts")
+    def iter_posts(
+        self,
+        limit: int | None = None,
+        predicate: Callable[["Post"], bool] | None = None,
+    ) -> Iterator["Post"]:
+        """Yields the posts of the listing that match predicate until limit of
+        them were yielded or the listing ends. The next page is requested in
+        the background while the current one is being consumed."""
+        print(
+            f"Trying to access {self.listing} posts of {self.timeframe} from {self.subreddit}"
+        )
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            next_page = executor.submit(copy_context().run, self.load_page, None)
+            found = 0
+            while next_page != None:
+                try:
+                    posts, after = next_page.result()
+                except Exception as e:
+                    print(f"an error occured while searching for posts: {e}")
+                    return
+
+                next_page = None
+                if after != None:
+                    # the next page might never be needed, so it waits for
+                    # the requests of the current job
+                    next_page = executor.submit(
+                        copy_context().run, self.load_page, after, PRIORITY_PREFETCH
+                    )
+
+                for post in posts:
+                    if predicate != None and not predicate(post):
+                        continue
+                    yield post
+                    found += 1
+                    if limit != None and found >= limit:
+                        return
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def search_subreddits(
+    subreddits: list[str],
+    listing: Literal["controversial", "best", "hot", "new", "random", "rising", "top"],
+    timeframe: Literal["day", "week", "month", "year", "all"],
+) -> list["Post"]:
+    """First page of the listing of every subreddit, requested concurrently.
+    Subreddits that cannot be reached are left out."""
+    return asyncio.run(search_subreddits_async(subreddits, listing, timeframe))
+
+
+async def search_subreddits_async(
+    subreddits: list[str],
+    listing: Literal["controversial", "best", "hot", "new", "random", "rising", "top"],
+    timeframe: Literal["day", "week", "month", "year", "all"],
+) -> list["Post"]:
+    semaphore = asyncio.Semaphore(reddit_client.max_concurrent)
+
+    async def load(client: httpx.AsyncClient, subreddit: str) -> list[Post]:
+        async with semaphore:
+            try:
+                search = PostSearch(subreddit, listing, timeframe, lazy=True)
+                posts, _ = await search.load_page_async(
+                    client, None, PRIORITY_PREFETCH
+                )
+                return posts
+            except Exception as e:
+                print(f"an error occured while searching for posts in {subreddit}: {e}")
+                return []
+
+    async with reddit_client.async_session() as client:
+        pages = await asyncio.gather(
+            *[load(client, subreddit) for subreddit in dict.fromkeys(subreddits)]
+        )
+    return [post for page in pages for post in page]
 
 
 class Post:
@@ -52,18 +167,54 @@ class Post:
         try:
             print(f"Trying to access comments of post {self.post_id}")
             base_url = f"https://www.reddit.com/{self.post_id}/.json?sort={listing}"
-            request = requests.get(base_url, headers={"User-agent": "yourbot"})
-            comments = request.json()[1]["data"]["children"]
-
-            for comment in comments:
-                self.comments.append(Comment(comment))
+            self.comment_sort = listing
+            self.comments += parse_comment_tree(
+                reddit_client.get_json(base_url)[1], self.more_comment_ids
+            )
         except Exception as e:
             print(
                 f"{type(e).__name__} at line {e.__traceback__.tb_lineno} of {__file__}: {e}"  # type: ignore
             )
             print("an error cccured while searching for comments")
 
-    def __init__(self, post) -> None:
+    def load_more_comments(self) -> bool:
+        """Loads the next top level comments that were left out of the thread.
+        Reddit only allows one morechildren request at a time, so this is a
+        single request. On failure the ids are kept to try again later and
+        False is returned."""
+        ids = self.more_comment_ids[:MORECHILDREN_BATCH_SIZE]
+        self.more_comment_ids = self.more_comment_ids[len(ids) :]
+        base_url = f"https://www.reddit.com/api/morechildren.json?api_type=json&link_id=t3_{self.post_id}&sort={self.comment_sort}&limit_children=false&children={','.join(ids)}"
+
+        print(f"Trying to access {len(ids)} more comments of post {self.post_id}")
+        try:
+            things = reddit_client.get_json(base_url)["json"]["data"]["things"]
+        except Exception as e:
+            print(f"an error occured while loading more comments: {e}")
+            self.more_comment_ids = ids + self.more_comment_ids
+            return False
+        self.comments += comments_from_things(
+            things, f"t3_{self.post_id}", self.more_comment_ids
+        )
+        return True
+
+    def has_enough_comments(self, score_threshold: int, num_chars: int) -> bool:
+        # enough once a comment no longer fits. get_good_comments always drops
+        # the last comment, but the one that does not fit is cut anyway
+        needed = num_chars
+        for comment in self.comments:
+            if (
+                comment.raw_body == "[removed]"
+                or comment.raw_body == "[deleted]"
+                or comment.chain_score <= score_threshold
+            ):
+                continue
+            needed -= len(comment.body)
+            if needed < 0:
+                return True
+        return False
+
+    def __init__(self, post, cleaned_selftext: str | None = None) -> None:
         self.subreddit: str = get_parameter(post, "subreddit")
         self.title: str = get_parameter(post, "title")
         self.author: str = get_parameter(post, "author")
@@ -79,8 +230,16 @@ class Post:
         sr_detail = get_parameter(post, "sr_detail")
         self.subreddit_icon_url: str = sr_detail["icon_img"] # type: ignore
         self.comments: list[Comment] = []
-
-        self.selftext = text_cleanup(self.selftext)
+        self.comment_sort = "top"
+        self.more_comment_ids: list[str] = []
+        # the listing entry the post was created from
+        self.data = post
+
+        # the post store keeps the text it was already cleaned up to
+        if cleaned_selftext != None:
+            self.selftext = cleaned_selftext
+        else:
+            self.selftext = text_cleanup(self.selftext)
 
     def get_good_comments(
         self, score_threshold: int = 300, num_chars_to_limit_comments: int | None = None
@@ -88,20 +247,31 @@ class Post:
         if len(self.comments) == 0:
             self.load_comments("top")
 
+        # comments reddit left out of the thread are only loaded while the
+        # ones so far are not enough
+        while (
+            num_chars_to_limit_comments != None
+            and len(self.more_comment_ids) > 0
+            and not self.has_enough_comments(
+                score_threshold, num_chars_to_limit_comments
+            )
+        ):
+            if not self.load_more_comments():
+                break
+
         print(f"There are {len(self.comments)} comments")
 
         for index, comment in enumerate(self.comments):
-            chain_score = calc_chain_score(comment)
             print(
-                f"Comment {index} from {comment.author} has {comment.score} score. This comment chain has a combined {chain_score}"
+                f"Comment {index} from {comment.author} has {comment.score} score. This comment chain has a combined {comment.chain_score}"
             )
 
         # TODO filter removed comments
 
         filtered_comments = list(
             filter(
-                lambda comment: comment.body != "[removed]"
-                and comment.body != "[deleted]",
+                lambda comment: comment.raw_body != "[removed]"
+                and comment.raw_body != "[deleted]",
                 self.comments,
             )
         )
@@ -112,7 +282,7 @@ class Post:
 
         filtered_comments = list(
             filter(
-                lambda comment: calc_chain_score(comment) > score_threshold,
+                lambda comment: comment.chain_score > score_threshold,
                 filtered_comments,
             )
         )[:-1]
@@ -131,6 +301,23 @@ class Post:
 
 
 class Comment:
+    """One comment of a thread. The body is only cleaned up for narration
+    when it is first read, chain_score is the score of the comment and all
+    of its replies."""
+
+    __slots__ = (
+        "author",
+        "raw_body",
+        "cleaned_body",
+        "replies",
+        "upvotes",
+        "downvotes",
+        "score",
+        "gilded",
+        "id",
+        "chain_score",
+    )
+
     def __str__(self) -> str:
         return f'{self.author} wrote: "{self.body}"'
 
@@ -141,50 +328,102 @@ class Comment:
             chain += self.replies[0].load_comment_chain(depth - 1)
         return chain
 
-    def __init__(self, comment, ignore_replies=False) -> None:
+    def __init__(
+        self,
+        comment,
+        ignore_replies=False,
+        replies: "list[Comment] | None" = None,
+    ) -> None:
         self.author: str = get_parameter(comment, "author")
-        self.body: str = get_parameter(comment, "body")
-        if ignore_replies:
+        self.raw_body: str = get_parameter(comment, "body")
+        self.cleaned_body: str | None = None
+        if replies != None:
+            self.replies: list[Comment] = replies
+        elif ignore_replies:
             print("ignoring replies")
             self.replies = []
         else:
-            self.replies: list[Comment] = handle_replies(
-                get_parameter(comment, "replies")
-            )
+            self.replies = parse_comment_tree(get_parameter(comment, "replies"))
         self.upvotes: int = int(get_parameter(comment, "ups"))
         self.downvotes: int = int(get_parameter(comment, "downs"))
         self.score: int = int(get_parameter(comment, "score"))
         self.gilded: int = int(get_parameter(comment, "gilded"))
         self.id: str = str(get_parameter(comment, "id"))
+        self.chain_score: int = self.score + sum(
+            reply.chain_score for reply in self.replies
+        )
 
-        self.body = text_cleanup(self.body)
+    @property
+    def body(self) -> str:
+        if self.cleaned_body == None:
+            self.cleaned_body = text_cleanup(self.raw_body)
+        return self.cleaned_body
 
 
 def create_post_from_post_id(post_id: str) -> Post:
     base_url = f"https://www.reddit.com/{post_id}.json?sr_detail=1"
     print(base_url)
-    request = requests.get(base_url, headers={"User-agent": useragent})
-    post = request.json()[0]
+    post = reddit_client.get_json(base_url)[0]
     post = get_parameter(post, "children")[0]
     # print(post)
     return Post(post)
 
 
-def handle_replies(replies) -> list[Comment]:
-    ret = []
+def listing_children(listing) -> list:
+    # reddit sends an empty string instead of a listing without replies
+    if isinstance(listing, str):
+        return []
+    return listing["data"]["children"]
+
+
+def parse_comment_tree(listing, more_ids: list[str] | None = None) -> list[Comment]:
+    """Comments of a listing with all of their replies. The tree is walked
+    without recursion and every comment is created after its replies, so
+    each chain score is summed up exactly once. Ids of top level comments
+    that reddit left out of the listing are added to more_ids."""
+    comments: list[Comment] = []
+    # raw comment, its finished replies and the replies still to visit
+    stack = [(None, comments, iter(listing_children(listing)))]
+    while len(stack) > 0:
+        raw, replies, pending = stack[-1]
+        child = next(pending, None)
+        if child == None:
+            stack.pop()
+            if raw != None:
+                stack[-1][1].append(Comment(raw, replies=replies))
+        elif "kind" in child and child["kind"] == "more":
+            # left out replies only matter for chain scores and are not loaded
+            if len(stack) == 1 and more_ids != None:
+                more_ids += child["data"]["children"]
+        else:
+            stack.append(
+                (child, [], iter(listing_children(get_parameter(child, "replies"))))
+            )
+    return comments
+
+
+def comments_from_things(
+    things: list, parent_name: str, more_ids: list[str]
+) -> list[Comment]:
+    """Turns the flat list of comments that the morechildren endpoint returns
+    back into the trees below parent_name."""
+    listings: dict[str, dict] = {}
+
+    def listing(name: str) -> dict:
+        if name not in listings:
+            listings[name] = {"kind": "Listing", "data": {"children": []}}
+        return listings[name]
 
-    if isinstance(replies, str):
-        pass
-    else:
-        for child in replies["data"]["children"]:
-            if "kind" in child and child["kind"] == "more":
-                # TODO handle loading more comments
-                # print(replies)
-                pass
-            else:
-                ret.append(Comment(child))
+    for thing in things:
+        if thing["kind"] == "t1":
+            name = f"t1_{thing['data']['id']}"
+            thing = {
+                "kind": "t1",
+                "data": {**thing["data"], "replies": listing(name)},
+            }
+        listing(thing["data"]["parent_id"])["data"]["children"].append(thing)
 
-    return ret
+    return parse_comment_tree(listing(parent_name), more_ids)
 
 
 def get_parameter(data, parameter):
@@ -198,12 +437,3 @@ def get_parameter(data, parameter):
         return data[parameter]
 
     raise Exception("Unknown Parameter")
-
-
-def calc_chain_score(comment: Comment, skip_first: bool = True) -> int:
-    sum = comment.score
-
-    for reply in comment.replies:
-        sum += calc_chain_score(reply, False)
-
-    return sum
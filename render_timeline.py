@@ -0,0 +1,88 @@
+from typing import Tuple
+import numpy as np
+from PIL import Image
+from moviepy import VideoClip
+
+
+class TimelineCaption:
+    def __init__(self, clip: VideoClip, start: float, end: float) -> None:
+        self.clip = clip
+        self.start = start
+        self.end = end
+
+    def to_rgba(self) -> np.ndarray:
+        rgb = self.clip.get_frame(0)
+        if self.clip.mask is not None:
+            alpha = self.clip.mask.get_frame(0) * 255
+        else:
+            alpha = np.full(rgb.shape[:2], 255)
+        return np.dstack((rgb, alpha)).astype(np.uint8)
+
+    def save_png(self, filename: str):
+        Image.fromarray(self.to_rgba(), "RGBA").save(filename)
+
+    def save_frame_png(self, filename: str, resolution: Tuple[int, int]):
+        # centered on a transparent frame, like with_position("center")
+        image = Image.fromarray(self.to_rgba(), "RGBA")
+        frame = Image.new("RGBA", resolution, (0, 0, 0, 0))
+        frame.paste(
+            image,
+            ((resolution[0] - image.width) // 2, (resolution[1] - image.height) // 2),
+        )
+        # mostly transparent, fast compression is nearly as small
+        frame.save(filename, compress_level=1)
+
+
+class SavedCaption:
+    """Caption that was written to a PNG file, so that it can be handed to
+    ffmpeg or to another process."""
+
+    def __init__(self, filename: str, start: float, end: float) -> None:
+        self.filename = filename
+        self.start = start
+        self.end = end
+
+    def to_rgba(self) -> np.ndarray:
+        with Image.open(self.filename) as image:
+            return np.asarray(image.convert("RGBA"))
+
+
+class Timeline:
+    """Plain description of a finished video: which part of which background
+    file to show, which caption is visible when and which audio to play.
+    Render backends that do not go through MoviePy work from this."""
+
+    def __init__(self, resolution: Tuple[int, int]) -> None:
+        self.resolution = resolution
+        self.captions: list[TimelineCaption] = []
+        self.offset: float = 0
+        self.duration: float = 0
+        self.background = None
+        self.narration_audio: str | None = None
+
+    def add_caption(self, clip: VideoClip, start: float, end: float):
+        # start and end are relative to the clip currently being added
+        self.captions.append(
+            TimelineCaption(clip, self.offset + start, self.offset + end)
+        )
+
+    def advance(self, duration: float):
+        self.offset += duration
+
+    def save_captions(self, tmp_prefix: str) -> list[SavedCaption]:
+        saved: list[SavedCaption] = []
+        for index, caption in enumerate(self.captions):
+            filename = f"{tmp_prefix}-caption-{index}.png"
+            caption.save_png(filename)
+            saved.append(SavedCaption(filename, caption.start, caption.end))
+        return saved
+
+    def save_caption_frames(self, tmp_prefix: str) -> list[SavedCaption]:
+        """Captions as PNGs of the full frame size, so that they can be read
+        as a single stream of frames that never changes its size."""
+        saved: list[SavedCaption] = []
+        for index, caption in enumerate(self.captions):
+            filename = f"{tmp_prefix}-caption-frame-{index}.png"
+            caption.save_frame_png(filename, self.resolution)
+            saved.append(SavedCaption(filename, caption.start, caption.end))
+        return saved
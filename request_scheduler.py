@@ -0,0 +1,109 @@
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+
+# lower numbers are served first
+PRIORITY_JOB = 0
+PRIORITY_PREFETCH = 1
+
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class RequestScheduler:
+    """Token bucket shared by every request of a client. Until the server
+    says otherwise it allows requests_per_minute, afterwards the remaining
+    requests of the current window are spread evenly over the time until it
+    resets, keeping reserve of them unused. A waiting request with a lower
+    priority number is always let through first."""
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        burst: int,
+        reserve: int,
+        backoff_base: float,
+        backoff_max: float,
+    ) -> None:
+        self.rate = requests_per_minute / 60
+        self.capacity = float(burst)
+        self.reserve = reserve
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiting: list[tuple[int, int]] = []
+        self.tickets = itertools.count()
+        self.condition = threading.Condition()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority: int = PRIORITY_JOB):
+        """Blocks until the request may be sent."""
+        with self.condition:
+            ticket = (priority, next(self.tickets))
+            heapq.heappush(self.waiting, ticket)
+            while True:
+                now = time.monotonic()
+                self.refill(now)
+                if self.waiting[0] != ticket:
+                    # only the first in line waits for tokens, the others
+                    # are woken up once it is through
+                    self.condition.wait()
+                elif now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                elif self.tokens < 1:
+                    self.condition.wait((1 - self.tokens) / self.rate)
+                else:
+                    heapq.heappop(self.waiting)
+                    self.tokens -= 1
+                    self.condition.notify_all()
+                    return
+
+    async def acquire_async(self, priority: int = PRIORITY_JOB):
+        await asyncio.to_thread(self.acquire, priority)
+
+    def update(self, headers):
+        """Adjusts the rate to the x-ratelimit headers of a response. Several
+        processes sharing the same limit see each others requests in them."""
+        remaining = headers.get("x-ratelimit-remaining")
+        reset = headers.get("x-ratelimit-reset")
+        if remaining == None or reset == None:
+            return
+
+        usable = float(remaining) - self.reserve
+        reset = max(float(reset), 1.0)
+        with self.condition:
+            now = time.monotonic()
+            self.refill(now)
+            if usable < 1:
+                self.tokens = 0
+                self.paused_until = max(self.paused_until, now + reset)
+            else:
+                self.rate = usable / reset
+                self.tokens = min(self.tokens, usable)
+            self.condition.notify_all()
+
+    def pause(self, seconds: float):
+        # nobody sends anything until the server accepts requests again
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.condition.notify_all()
+
+    def backoff(self, attempt: int, retry_after: str | None = None) -> float:
+        """Seconds to wait before retrying a failed request. Random, so
+        requests that failed together are not retried together."""
+        delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+        delay = random.uniform(delay / 2, delay)
+        if retry_after != None:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
@@ -1,5 +1,6 @@
 from datetime import timedelta
-from random import randrange
+import os
+from random import randrange, sample
 import string
 import subprocess
 import sys
@@ -11,13 +12,21 @@ from configuration import Configuration
 from video_utils import (
     check_if_valid_post,
     crop_to_center_and_resize,
+    duration_bounds,
+    generate_intro_audio,
     generate_intro_clip,
+    generate_outro_audio,
     generate_outro_clip,
     select_background_video,
+    write_atomically,
 )
 from openai_interface import OpenAiInterface
 
-from reddit_requests import Post, PostSearch
+from reddit_requests import Post, PostSearch, search_subreddits
+from post_store import post_store
+from render_timeline import Timeline
+from caption_cache import caption_clip
+from instrumentation import span
 
 config = Configuration()
 
@@ -35,30 +44,73 @@ class Timestamp:
         self.to_time = to_time
 
 
+class StoryNarration:
+    """Speech of a story and its alignment. They are created once and shared
+    by every resolution the video is rendered in."""
+
+    def __init__(
+        self,
+        audio_file: str,
+        textgrid_file: str,
+        intro_audio: str | None,
+        outro_audio: str | None,
+    ) -> None:
+        self.audio_file = audio_file
+        self.textgrid_file = textgrid_file
+        self.intro_audio = intro_audio
+        self.outro_audio = outro_audio
+
+
+def generate_story_narration(
+    post: Post, language: str, add_intro: bool, add_outro: bool
+) -> StoryNarration:
+    text: str = post.selftext
+
+    intro_audio = generate_intro_audio(post) if add_intro else None
+    outro_audio = generate_outro_audio(post) if add_outro else None
+
+    audio_file = f"tmp/{post.post_id}-audio.mp3"
+    openaiinterface = OpenAiInterface()
+    print("generating audio")
+    openaiinterface.generate_mp3(text, audio_file)
+
+    wav_file = f"tmp/{post.post_id}-audio.wav"
+    with span("mp3_to_wav"):
+        write_atomically(
+            wav_file, lambda f: AudioFileClip(audio_file).write_audiofile(f)
+        )
+
+    with open(f"tmp/{post.post_id}-audio.txt", "w", encoding="utf-8") as file:
+        exclude = set(string.punctuation)
+        file.write("".join(char for char in text if char not in exclude))
+
+    # mfa names its output after the audio file, an old one must not be used
+    textgrid_file = f"tmp/{post.post_id}-audio.TextGrid"
+    if os.path.exists(textgrid_file):
+        os.remove(textgrid_file)
+    with span("alignment"):
+        align_audio_and_text(wav_file, f"tmp/{post.post_id}-audio.txt", language)
+
+    return StoryNarration(audio_file, textgrid_file, intro_audio, outro_audio)
+
+
 def generate_story_clip(
     post: Post,
     resolution: Tuple[int, int],
-    language: str,
-    add_intro: bool,
-    add_outro: bool,
+    narration: StoryNarration,
+    timeline: Timeline | None = None,
 ) -> VideoClip:
     text: str = post.selftext
 
     intro: VideoClip | None = None
     outro: VideoClip | None = None
 
-    if add_intro:
-        intro = generate_intro_clip(post, resolution)
-    if add_outro:
-        outro = generate_outro_clip(post, resolution)
-
-    # print("SKIPPING GENERATING AUDIO")
-    openaiinterface = OpenAiInterface()
-    print("generating audio")
-    openaiinterface.generate_mp3(text, f"tmp/{post.post_id}-audio.mp3")
+    if narration.intro_audio != None:
+        intro = generate_intro_clip(post, resolution, narration.intro_audio)
+    if narration.outro_audio != None:
+        outro = generate_outro_clip(narration.outro_audio)
 
-    audio_clip: AudioClip = AudioFileClip(f"tmp/{post.post_id}-audio.mp3")
-    audio_clip.write_audiofile(f"tmp/{post.post_id}-audio.wav")
+    audio_clip: AudioClip = AudioFileClip(narration.audio_file)
 
     video_duration = audio_clip.duration
     if intro != None:
@@ -67,19 +119,21 @@ def generate_story_clip(
         video_duration += outro.duration
     print(f"the video will be {video_duration}s long")
 
-    with open(f"tmp/{post.post_id}-audio.txt", "w", encoding="utf-8") as file:
-        exclude = set(string.punctuation)
-        file.write("".join(char for char in text if char not in exclude))
-
-    align_audio_and_text(
-        f"tmp/{post.post_id}-audio.wav", f"tmp/{post.post_id}-audio.txt", language
-    )
+    if timeline != None and intro != None:
+        timeline.add_caption(intro, 0, intro.duration)
+        timeline.advance(intro.duration)
 
     combined_text_clip: VideoClip = generate_combined_text_clip(
-        text, resolution, f"tmp/{post.post_id}-audio.TextGrid"
+        text, resolution, narration.textgrid_file, timeline
     )
     combined_text_clip = combined_text_clip.with_audio(audio_clip)
 
+    if timeline != None:
+        timeline.advance(combined_text_clip.duration)
+        # the outro has no visible text
+        if outro != None:
+            timeline.advance(outro.duration)
+
     to_combine = [clip for clip in [intro, combined_text_clip, outro] if clip != None]
     combined_text_clip = concatenate_videoclips(to_combine)
     combined_text_clip = combined_text_clip.with_position("center")
@@ -175,7 +229,10 @@ def generate_timestamps(filename, text: str) -> list[Timestamp]:
 
 
 def generate_combined_text_clip(
-    text: str, resolution: Tuple[float, float], textgrid_filename: str
+    text: str,
+    resolution: Tuple[float, float],
+    textgrid_filename: str,
+    timeline: Timeline | None = None,
 ):
     text_clips: list[TextClip] = []
     timestamps: list[Timestamp] = generate_timestamps(textgrid_filename, text)
@@ -191,6 +248,8 @@ def generate_combined_text_clip(
         )
         text_clip = text_clip.with_position("center")
         text_clips.append(text_clip)
+        if timeline != None:
+            timeline.add_caption(text_clip, section.from_time, section.to_time)
     return CompositeVideoClip(text_clips, resolution).with_position("center")
 
 
@@ -200,17 +259,7 @@ def generate_text_clip(text: str, size: Tuple[float, float]):
     # cooper-black
     # franklin-gothic-heavy
 
-    return TextClip(
-        text=text,
-        method="caption",
-        color=config.video_font_color,
-        font=config.video_font,
-        font_size=config.video_font_size,
-        stroke_color=config.video_font_stroke_color,
-        stroke_width=config.video_font_stroke_width,
-        size=(size[0], size[1]),
-        align="center",
-    )
+    return caption_clip(text, config.video_font_size, size[0])
 
 
 def generate_text_list(text: str):
@@ -244,17 +293,8 @@ def find_story_post(
     min_duration: timedelta | None = None,
     max_duration: timedelta | None = None
 ):
-    selected_post = None
-    max_attempts = 50
-    for i in range(0, max_attempts):
-        subreddit = subreddit_list[randrange(0, len(subreddit_list))]
-        search = PostSearch(subreddit, listing, timeframe)
-
-        if not hasattr(search, "posts") or len(search.posts) < 1:
-            continue
-        p = search.posts[randrange(0, len(search.posts))]
-
-        valid = check_if_valid_post(
+    def is_valid(p: Post) -> bool:
+        return check_if_valid_post(
             p.post_id,
             p.title,
             p.selftext,
@@ -264,11 +304,28 @@ def find_story_post(
             max_duration=max_duration,
         )
 
-        if valid:
-            selected_post = p
-            break
-        
-    if selected_post == None:
-        raise Exception(f"No valid post found in {max_attempts} attempts.")
+    # the first pages of all subreddits are requested at once and added to
+    # the post store, which returns the best posts of the right length first
+    post_store.add_posts(
+        search_subreddits(subreddit_list, listing, timeframe), listing, timeframe
+    )
+    min_store_duration, max_store_duration = duration_bounds(
+        approx_video_duration, min_duration, max_duration
+    )
+    for p in post_store.candidates(
+        subreddit_list, listing, timeframe, min_store_duration, max_store_duration
+    ):
+        if is_valid(p):
+            return p
+
+    # then subreddits in random order, listed more than once means more likely
+    # first, are paged through until a valid post comes up
+    searched: list[str] = []
+    for subreddit in dict.fromkeys(sample(subreddit_list, len(subreddit_list))):
+        searched.append(subreddit)
+        search = PostSearch(subreddit, listing, timeframe, lazy=True)
+        for p in search.iter_posts(limit=1, predicate=is_valid):
+            return p
+
+    raise Exception(f"No valid post found in {', '.join(searched)}.")
 
-    return selected_post
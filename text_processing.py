@@ -1,90 +1,211 @@
+from bisect import bisect_right
+import os
 import re
-from markdown import Markdown
-from io import StringIO
+from typing import Callable, Iterator
 import unidecode
+from markdown_narration import markdown_to_narration
 
 
-def unmark_element(element, stream=None):
-    if stream is None:
-        stream = StringIO()
-    if element.text:
-        stream.write(element.text)
-    for sub in element:
-        unmark_element(sub, stream)
-    if element.tail:
-        stream.write(element.tail)
-    return stream.getvalue()
-
+def remove_markdown(text):
+    return markdown_to_narration(text)
 
-# patching Markdown
-Markdown.output_formats["plain"] = unmark_element  # type: ignore
-__md = Markdown(output_format="plain")  # type: ignore
-__md.stripTopLevelTags = False  # type: ignore
 
+# where a chunk of text may end, from most to least preferred
+sentence_end = re.compile(r"[.!?]+[\"')\]]*(?=\s|$)")
+clause_end = re.compile(r"[;:,]+(?=\s)")
+word_end = re.compile(r"(?<=\S)\s")
 
-def remove_markdown(text):
-    return __md.convert(text)
 
+def text_chunks(text: str, max_chars: int) -> Iterator[str]:
+    """Pieces of the text of at most max_chars characters. Each ends at the
+    last sentence that fits, otherwise at the last clause or word. Only a
+    word longer than max_chars is cut. All possible ends are found in one
+    scan beforehand, so the time is linear in the length of the text."""
+    if len(text) <= max_chars:
+        yield text
+        return
 
-def split_text_to_max_x_chars(text: str, x: int) -> list[str]:
-    if len(text) > x:
-        first_part = text[0:x]
+    ends = [
+        [match.end() for match in sentence_end.finditer(text)],
+        [match.end() for match in clause_end.finditer(text)],
+        [match.start() for match in word_end.finditer(text)],
+    ]
 
-        separate_by = " "
-        for sep in [".", ";", ","]:
-            if sep in first_part:
-                separate_by = sep
+    start = 0
+    while True:
+        while start < len(text) and text[start].isspace():
+            start += 1
+        if len(text) - start <= max_chars:
+            if start < len(text):
+                yield text[start:].rstrip()
+            return
+
+        end = start + max_chars
+        for positions in ends:
+            index = bisect_right(positions, start + max_chars) - 1
+            if index >= 0 and positions[index] > start:
+                end = positions[index]
                 break
-
-        period_index = first_part.rindex(separate_by)
-        first_part = text[0 : period_index + 1]
-        return [first_part] + split_text_to_max_x_chars(text[period_index + 1 :], x)
-    else:
-        return [text]
+        yield text[start:end].rstrip()
+        start = end
+
+
+class ReplacementTable:
+    """Replacements from a file with one "from,to" pair per line. They are
+    applied one after the other, since later lines clean up what earlier
+    ones leave behind. The file is only read again once it changed."""
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.modified: int | None = None
+        self.replacements: list[tuple[str, str]] = []
+
+    def load(self) -> list[tuple[str, str]]:
+        modified = os.stat(self.filename).st_mtime_ns
+        if modified != self.modified:
+            replacements: list[tuple[str, str]] = []
+            with open(self.filename) as file:
+                for line in file.readlines():
+                    line = line.strip("\n")
+                    replace_from, replace_to = line.split(",")
+                    replacements.append((replace_from, replace_to))
+            self.replacements = replacements
+            self.modified = modified
+        return self.replacements
+
+    def apply(self, text: str) -> str:
+        for replace_from, replace_to in self.load():
+            text = text.replace(replace_from, replace_to)
+        return text
+
+
+class Substitution:
+    """Replaces every match of pattern with replace(match) in a single pass.
+    Replacing each found match with str.replace also hits other occurrences
+    of the same text, which only makes a difference when matches can
+    overlap. For texts where overlaps finds such a spot that slower way is
+    still used, so the result is always the same."""
+
+    def __init__(
+        self,
+        pattern: str,
+        replace: Callable[[str], str],
+        overlaps: Callable[[str], object],
+    ) -> None:
+        self.pattern = re.compile(pattern)
+        self.replace = replace
+        self.overlaps = overlaps
+
+    def apply(self, text: str) -> str:
+        if self.overlaps(text):
+            for match in self.pattern.findall(text):
+                text = text.replace(match, self.replace(match))
+            return text
+        return self.pattern.sub(lambda match: self.replace(match.group()), text)
+
+
+replace_in_text = ReplacementTable("config/replace_in_text.txt")
+
+to_remove_paragraph_if_starts_with = [
+    "edit",
+    "edit:",
+    "tldr",
+    "tl;dr",
+    "tl:dr",
+    "tl,dr",
+    "update:",
+    "disclaimer",
+]
+
+to_remove_paragraph_if_included = [
+    "throwaway",
+    "repost",
+    "made this account",
+    "is the right subreddit",
+    "spelling",
+    "formatting",
+    "first time posting",
+    "first post",
+    "in r/",
+]
+
+lines_within_paragraph = Substitution(
+    r"[a-zA-Z]+\n[a-zA-Z]+",
+    lambda match: ". ".join(match.split("\n")),
+    re.compile(r"[a-zA-Z]\n[a-zA-Z]+\n[a-zA-Z]").search,
+)
+
+leading_dashes = re.compile(r"^--+[\s]")
+leading_underscores = re.compile(r"^__+[\s]")
+markdown_link = re.compile(r"(\[([^\]]+)\]\((\S+(?=\)))\))")
+ellipsis = re.compile(r"\.\.\.\.+")
+
+quotes_within_words = Substitution(
+    '[a-zA-Z]+"[a-zA-Z]+',
+    lambda match: " ".join(match.split('"')),
+    re.compile('[a-zA-Z]"[a-zA-Z]+"[a-zA-Z]').search,
+)
+
+substitutions = [
+    Substitution(
+        r"[a-zA-Z]\(",
+        lambda match: " (".join(match.split("(")),
+        lambda text: False,
+    ),
+    Substitution(
+        r"\)[a-zA-Z]",
+        lambda match: ") ".join(match.split(")")),
+        lambda text: False,
+    ),
+    Substitution(
+        "[a-zA-Z],[a-zA-Z]",
+        lambda match: ", ".join(match.split(",")),
+        re.compile("[a-zA-Z],[a-zA-Z],[a-zA-Z]").search,
+    ),
+    Substitution(
+        "[a-zA-Z] - [a-zA-Z]",
+        lambda match: ", ".join(match.split(" - ")),
+        re.compile("[a-zA-Z] - [a-zA-Z] - [a-zA-Z]").search,
+    ),
+    Substitution(
+        "[a-zA-Z] ,[a-zA-Z]",
+        lambda match: ", ".join(match.split(" ,")),
+        re.compile("[a-zA-Z] ,[a-zA-Z] ,[a-zA-Z]").search,
+    ),
+    # shortening one run of dots breaks up longer ones
+    Substitution(
+        ellipsis.pattern,
+        lambda match: "...",
+        lambda text: len(set(ellipsis.findall(text))) > 1,
+    ),
+    Substitution(
+        r"[a-zA-Z]\.\.\.[a-zA-Z]",
+        lambda match: "... ".join(match.split("...")),
+        re.compile(r"[a-zA-Z]\.\.\.[a-zA-Z]\.\.\.[a-zA-Z]").search,
+    ),
+]
 
 
 def text_cleanup(text: str) -> str:
     text = remove_markdown(text)
 
-    to_remove_paragraph_if_starts_with = [
-        "edit",
-        "edit:",
-        "tldr",
-        "tl;dr",
-        "tl:dr",
-        "tl,dr",
-        "update:",
-        "disclaimer",
-    ]
-    
     for paragraph in text.split("\n"):
+        lowered = paragraph.lower()
         for phrase in to_remove_paragraph_if_starts_with:
-            if paragraph.lower().startswith(phrase):
+            if lowered.startswith(phrase):
                 # print(f"replacing paragraph starting with {phrase}")
                 text = text.replace(paragraph, "")
 
-    to_remove_paragraph_if_included = [
-        "throwaway",
-        "repost",
-        "made this account",
-        "is the right subreddit",
-        "spelling",
-        "formatting",
-        "first time posting",
-        "first post",
-        "in r/",
-    ]
+    beginning = text.lower()[: int(len(text) * 0.3)]
     for phrase in to_remove_paragraph_if_included:
-        if phrase in text.lower()[: int(len(text) * 0.3)]:
+        if phrase in beginning:
             edit_position = 0
             if "\n" in text[:edit_position]:
                 edit_position = text[:edit_position].rindex("\n")
             text = text.replace(text[edit_position : text.index("\n")], "")
+            beginning = text.lower()[: int(len(text) * 0.3)]
 
-    for match in re.findall("[a-zA-Z]+\n[a-zA-Z]+", text):
-        replace_with = ". ".join(match.split("\n"))
-        text = text.replace(match, replace_with)
-        # print(f"replacing {match} with {replace_with}")
+    text = lines_within_paragraph.apply(text)
 
     text = " ".join(text.split())
     text = text.replace(" , ", ", ")
@@ -93,67 +214,19 @@ def text_cleanup(text: str) -> str:
 
     text = unidecode.unidecode(text)
 
-    for match in re.findall('[a-zA-Z]+"[a-zA-Z]+', text):
-        replace_with = " ".join(match.split('"'))
-        text = text.replace(match, replace_with)
-        # print(f"replacing {match} with {replace_with}")
+    text = quotes_within_words.apply(text)
 
-    for match in re.findall("^--+[\s]", text):
+    # only ever matches once at the very beginning
+    for match in leading_dashes.findall(text):
         text = text.replace(match, "")
-        # print(f"replacing {match} with {replace_with}")
-
-    for match in re.findall("^__+[\s]", text):
+    for match in leading_underscores.findall(text):
         text = text.replace(match, "")
-        # print(f"replacing {match} with {replace_with}")
-
-    for match in re.findall("[a-zA-Z]\(", text):
-        replace_with = " (".join(match.split("("))
-        text = text.replace(match, replace_with)
-        # print(f"replacing {match} with {replace_with}")
-
-    for match in re.findall("\)[a-zA-Z]", text):
-        replace_with = ") ".join(match.split(")"))
-        text = text.replace(match, replace_with)
-        # print(f"replacing {match} with {replace_with}")
-
-    for match in re.findall("[a-zA-Z],[a-zA-Z]", text):
-        replace_with = ", ".join(match.split(","))
-        text = text.replace(match, replace_with)
-        # print(f"replacing {match} with {replace_with}")
-
-    for match in re.findall("[a-zA-Z] - [a-zA-Z]", text):
-        replace_with = ", ".join(match.split(" - "))
-        text = text.replace(match, replace_with)
-        # print(f"replacing {match} with {replace_with}")
-
-    for match in re.findall("[a-zA-Z] ,[a-zA-Z]", text):
-        replace_with = ", ".join(match.split(" ,"))
-        text = text.replace(match, replace_with)
-        # print(f"replacing {match} with {replace_with}")
-
-    for match in re.findall("\.\.\.\.+", text):
-        replace_with = "..."
-        text = text.replace(match, replace_with)
-        # print(f"replacing {match} with {replace_with}")
-
-    for match in re.findall("[a-zA-Z]\.\.\.[a-zA-Z]", text):
-        replace_with = "... ".join(match.split("..."))
-        text = text.replace(match, replace_with)
-        # print(f"replacing {match} with {replace_with}")
+
+    for substitution in substitutions:
+        text = substitution.apply(text)
 
     # markdown links
-    for match in re.findall("(\[([^\]]+)\]\((\S+(?=\)))\))", text):
-        replace_with = match[1]
-        # print(f"replacing {match[0]} with {replace_with}")
+    for match in markdown_link.findall(text):
         text = text.replace(match[0], match[1])
 
-    with open("config/replace_in_text.txt") as file:
-        for line in file.readlines():
-            line = line.strip("\n")
-            replace_from, replace_to = line.split(",")
-            # print(f"replacing \"{replace_from}\" with \"{replace_to}\"")
-            text = text.replace(replace_from, replace_to)
-
-    # print(self.post_id)
-    # print(text)
-    return text
+    return replace_in_text.apply(text)
@@ -0,0 +1,221 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+import os
+import sys
+from typing import Tuple
+from PIL import Image, ImageDraw, ImageFont
+from caption_renderer import wrap_lines
+from configuration import Configuration
+from icon_cache import subreddit_icon_cache
+from reddit_requests import Post, create_post_from_post_id
+
+config = Configuration()
+
+ICON_DOWNLOAD_WORKERS = 8
+
+fonts: dict[Tuple[str, int], ImageFont.FreeTypeFont] = {}
+icons: dict[Tuple[str, int, str | None], Image.Image] = {}
+
+
+def get_font(font_file: str, font_size: int) -> ImageFont.FreeTypeFont:
+    key = (font_file, font_size)
+    if key not in fonts:
+        fonts[key] = ImageFont.truetype(font_file, font_size)
+    return fonts[key]
+
+
+def get_icon(filename: str, size: int, color: str | None = None) -> Image.Image:
+    """Icon loaded from disk, resized to a square and, if a color is given,
+    filled with that color. Every combination is only prepared once."""
+    key = (filename, size, color)
+    if key in icons:
+        return icons[key]
+
+    with Image.open(filename) as image:
+        icon = image.convert("RGBA").resize((size, size), Image.LANCZOS)
+    if color != None:
+        recolored = Image.new("RGBA", icon.size, color)
+        recolored.putalpha(icon.getchannel("A"))
+        icon = recolored
+
+    icons[key] = icon
+    return icon
+
+
+def load_subreddit_icon(url: str) -> Image.Image | None:
+    return subreddit_icon_cache.get(url)
+
+
+def subreddit_icon_or_default(icon: Image.Image | None) -> Image.Image:
+    if icon == None:
+        print("could not find subreddit icon. using default reddit logo.")
+        return get_icon(
+            config.thumbnail_default_subreddit_icon,
+            config.thumbnail_subreddit_icon_size,
+        )
+    return icon
+
+
+def text_height(font: ImageFont.FreeTypeFont) -> int:
+    ascent, descent = font.getmetrics()
+    return ascent + descent
+
+
+def render_thumbnail(
+    post: Post, resolution: Tuple[int, int], subreddit_icon: Image.Image
+) -> Image.Image:
+    margin = config.thumbnail_element_margin
+    left = int(config.thumbnail_side_offset * resolution[0])
+
+    subreddit_font = get_font(
+        config.thumbnail_subreddit_text_font_file, config.thumbnail_subreddit_text_size
+    )
+    main_font = get_font(
+        config.thumbnail_main_text_font_file, config.thumbnail_main_text_size
+    )
+    like_font = get_font(
+        config.thumbnail_like_text_font_file, config.thumbnail_like_text_size
+    )
+    like_icon_size = config.thumbnail_like_icon_size
+    upvotes_icon = get_icon(
+        config.thumbnail_upvotes_icon,
+        like_icon_size,
+        config.thumbnail_like_text_color,
+    )
+    comments_icon = get_icon(
+        config.thumbnail_comments_icon,
+        like_icon_size,
+        config.thumbnail_like_text_color,
+    )
+
+    lines = wrap_lines(
+        main_font.getlength,
+        post.title,
+        resolution[0] * (1 - 2 * config.thumbnail_side_offset),
+    )
+    line_height = text_height(main_font)
+    subreddit_height = max(subreddit_icon.height, text_height(subreddit_font))
+    text_part_height = line_height * len(lines)
+    upvotes_height = max(like_icon_size, text_height(like_font))
+    combined_height = subreddit_height + text_part_height + upvotes_height + 2 * margin
+
+    image = Image.new("RGB", resolution, config.thumbnail_background_color)
+    draw = ImageDraw.Draw(image)
+
+    # subreddit icon with the subreddit name next to it
+    top = int(0.5 * resolution[1] - combined_height / 2)
+    image.paste(
+        subreddit_icon,
+        (left, top + (subreddit_height - subreddit_icon.height) // 2),
+        subreddit_icon,
+    )
+    draw.text(
+        (
+            left + subreddit_icon.width + margin,
+            top + (subreddit_height - text_height(subreddit_font)) // 2,
+        ),
+        f"r/{post.subreddit}",
+        fill=config.thumbnail_subreddit_text_color,
+        font=subreddit_font,
+    )
+
+    top += subreddit_height + margin
+    for line_index, line in enumerate(lines):
+        draw.text(
+            (left, top + line_index * line_height),
+            line,
+            fill=config.thumbnail_main_text_color,
+            font=main_font,
+        )
+
+    # upvote icon and count, then comment icon and count
+    top += text_part_height + margin
+    x = left
+    for icon, count, spacing in [
+        (upvotes_icon, post.upvotes, 3 * margin),
+        (comments_icon, post.num_comments, 0),
+    ]:
+        image.paste(icon, (x, top + (upvotes_height - like_icon_size) // 2), icon)
+        x += like_icon_size + margin
+        draw.text(
+            (x, top + (upvotes_height - text_height(like_font)) // 2),
+            str(count),
+            fill=config.thumbnail_like_text_color,
+            font=like_font,
+        )
+        x += round(like_font.getlength(str(count))) + spacing
+
+    return image
+
+
+def render_thumbnails(
+    posts: list[Post], resolutions: list[Tuple[int, int]]
+) -> list[list[Image.Image]]:
+    """Thumbnails of every post in every resolution. Subreddit icons are
+    downloaded concurrently and only once per subreddit."""
+    urls = list(dict.fromkeys(post.subreddit_icon_url for post in posts))
+    with ThreadPoolExecutor(max_workers=ICON_DOWNLOAD_WORKERS) as executor:
+        # each download keeps the current span so its requests are counted
+        futures = [
+            executor.submit(copy_context().run, load_subreddit_icon, url)
+            for url in urls
+        ]
+        subreddit_icons = {url: future.result() for url, future in zip(urls, futures)}
+
+    thumbnails: list[list[Image.Image]] = []
+    for post in posts:
+        subreddit_icon = subreddit_icon_or_default(
+            subreddit_icons[post.subreddit_icon_url]
+        )
+        thumbnails.append(
+            [
+                render_thumbnail(post, resolution, subreddit_icon)
+                for resolution in resolutions
+            ]
+        )
+    return thumbnails
+
+
+def existing_thumbnails(post_dir: str) -> list[Tuple[str, Tuple[int, int]]]:
+    thumbnails: list[Tuple[str, Tuple[int, int]]] = []
+    for f in sorted(os.listdir(post_dir)):
+        if f.startswith("thumbnail") and f.endswith(".jpg"):
+            with Image.open(os.path.join(post_dir, f)) as image:
+                thumbnails.append((os.path.join(post_dir, f), image.size))
+    return thumbnails
+
+
+def regenerate_thumbnails(post_ids: list[str]):
+    """Renders the thumbnails of already generated videos again, in the
+    resolutions they were saved in, e.g. after the thumbnail style changed."""
+    # posts whose thumbnails have the same resolutions are rendered together
+    batches: dict[tuple, list[Tuple[Post, list[str]]]] = {}
+    for post_id in post_ids:
+        thumbnails = existing_thumbnails(config.output_dir + post_id)
+        if len(thumbnails) == 0:
+            print(f"{post_id} has no thumbnail. skipping")
+            continue
+        resolutions = tuple(size for _, size in thumbnails)
+        filenames = [filename for filename, _ in thumbnails]
+        batches.setdefault(resolutions, []).append(
+            (create_post_from_post_id(post_id), filenames)
+        )
+
+    for resolutions, batch in batches.items():
+        rendered = render_thumbnails([post for post, _ in batch], list(resolutions))
+        for (_, filenames), images in zip(batch, rendered):
+            for filename, image in zip(filenames, images):
+                print(f"saving {filename}")
+                image.save(filename)
+
+
+if __name__ == "__main__":
+    # python thumbnail_renderer.py [post_id ...], all videos if none are given
+    post_ids = sys.argv[1:]
+    if len(post_ids) == 0:
+        post_ids = sorted(
+            f
+            for f in os.listdir(config.output_dir)
+            if os.path.isdir(config.output_dir + f)
+        )
+    regenerate_thumbnails(post_ids)
@@ -1,12 +1,17 @@
 import sys
 from typing import Tuple
 from moviepy import CompositeVideoClip, ImageClip, TextClip, VideoClip
-from moviepy.video.fx import resize
 import numpy as np
 from configuration import Configuration
 from reddit_requests import Post, create_post_from_post_id
+from thumbnail_renderer import (
+    get_icon,
+    load_subreddit_icon,
+    render_thumbnail,
+    render_thumbnails,
+    subreddit_icon_or_default,
+)
 from PIL import Image
-import urllib.request
 
 config = Configuration()
 
@@ -17,46 +22,13 @@ def hex_to_rgb(hex: str) -> Tuple[int, int, int]:
     return tuple(int(hex[i : i + 2], 16) for i in (0, 2, 4))  # type: ignore
 
 
-def change_image_color(
-    img: Image.Image, new_color: Tuple[int, int, int]
+def generate_subreddit_part(
+    post: Post, subreddit_image: Image.Image | None = None
 ) -> Image.Image:
-    image = np.array(img)
-
-    rgb = image[..., :3]
-    alpha = image[..., 3]
-
-    non_transparent_pixels = alpha != 0
-    # new_color = np.array(new_color)
-
-    rgb[non_transparent_pixels] = new_color
-    modified_image_array = np.concatenate((rgb, alpha[..., np.newaxis]), axis=-1)
-    modified_image = Image.fromarray(modified_image_array.astype(np.uint8))
-    return modified_image
-
-
-def generate_subreddit_part(post: Post) -> Image.Image:
-    subreddit_image: Image.Image | None = None
-
-    print(f"trying to request subreddit icon")
-    for i in range(0, 5):
-        try:
-            with urllib.request.urlopen(post.subreddit_icon_url) as url:
-                subreddit_image = Image.open(url)
-                if subreddit_image.mode != "RGBA":
-                    subreddit_image = subreddit_image.convert("RGBA")
-                    subreddit_image = subreddit_image.resize(
-                        (
-                            config.thumbnail_subreddit_icon_size,
-                            config.thumbnail_subreddit_icon_size,
-                        )
-                    )
-                    break
-        except Exception:
-            print(f"retrying attempt {i}")
-
     if subreddit_image == None:
-        print("could not find subreddit icon. using default reddit logo.")
-        subreddit_image = Image.open(config.thumbnail_default_subreddit_icon)
+        subreddit_image = subreddit_icon_or_default(
+            load_subreddit_icon(post.subreddit_icon_url)
+        )
 
     icon_clip: ImageClip = ImageClip(np.asarray(subreddit_image))
 
@@ -108,25 +80,23 @@ def generate_upvotes_part(post: Post) -> Image.Image:
     positions: list[Tuple[int, int]] = []
     clips: list[VideoClip] = []
 
-    upvote_img = Image.open(config.thumbnail_upvotes_icon)
-    upvote_img = change_image_color(
-        upvote_img, hex_to_rgb(config.thumbnail_like_text_color)
+    upvote_image_arr = np.array(
+        get_icon(
+            config.thumbnail_upvotes_icon,
+            config.thumbnail_like_icon_size,
+            config.thumbnail_like_text_color,
+        )
     )
-    upvote_image_arr = np.array(upvote_img)
-
-    comments_img = Image.open(config.thumbnail_comments_icon)
-    comments_img = change_image_color(
-        comments_img, hex_to_rgb(config.thumbnail_like_text_color)
+    comments_img_arr = np.array(
+        get_icon(
+            config.thumbnail_comments_icon,
+            config.thumbnail_like_icon_size,
+            config.thumbnail_like_text_color,
+        )
     )
-    comments_img_arr = np.array(comments_img)
 
     positions.append((0, 0))
-    clips.append(
-        resize(
-            ImageClip(upvote_image_arr),
-            (config.thumbnail_like_icon_size, config.thumbnail_like_icon_size),
-        ).with_position(positions[-1])
-    )
+    clips.append(ImageClip(upvote_image_arr).with_position(positions[-1]))
     positions.append(
         (positions[-1][0] + clips[-1].size[0] + config.thumbnail_element_margin, 0)
     )
@@ -144,12 +114,7 @@ def generate_upvotes_part(post: Post) -> Image.Image:
     positions.append(
         (positions[-1][0] + clips[-1].size[0] + 3 * config.thumbnail_element_margin, 0)
     )
-    clips.append(
-        resize(
-            ImageClip(comments_img_arr),
-            (config.thumbnail_like_icon_size, config.thumbnail_like_icon_size),
-        ).with_position(positions[-1])
-    )
+    clips.append(ImageClip(comments_img_arr).with_position(positions[-1]))
 
     positions.append(
         (positions[-1][0] + clips[-1].size[0] + config.thumbnail_element_margin, 0)
@@ -178,8 +143,19 @@ def generate_upvotes_part(post: Post) -> Image.Image:
     return Image.fromarray(res.get_frame(0))
 
 
-def generate_thumbnail_with_text(post: Post, resolution: Tuple[int, int]):
-    subreddit_part = generate_subreddit_part(post)
+def generate_thumbnail_with_text(
+    post: Post,
+    resolution: Tuple[int, int],
+    subreddit_image: Image.Image | None = None,
+) -> Image.Image:
+    if config.thumbnail_renderer == "pillow":
+        if subreddit_image == None:
+            subreddit_image = subreddit_icon_or_default(
+                load_subreddit_icon(post.subreddit_icon_url)
+            )
+        return render_thumbnail(post, resolution, subreddit_image)
+
+    subreddit_part = generate_subreddit_part(post, subreddit_image)
     text_part = generate_text_part(post.title, resolution)
     upvotes_part = generate_upvotes_part(post)
     combined_height = (
@@ -213,3 +189,25 @@ def generate_thumbnail_with_text(post: Post, resolution: Tuple[int, int]):
     image.paste(upvotes_part, upvotes_part_pos)
 
     return image
+
+
+def generate_thumbnails_with_text(
+    posts: list[Post], resolutions: list[Tuple[int, int]]
+) -> list[list[Image.Image]]:
+    """Thumbnails of every post in every resolution, the subreddit icon of
+    each post is only requested once."""
+    if config.thumbnail_renderer == "pillow":
+        return render_thumbnails(posts, resolutions)
+
+    thumbnails: list[list[Image.Image]] = []
+    for post in posts:
+        subreddit_image = subreddit_icon_or_default(
+            load_subreddit_icon(post.subreddit_icon_url)
+        )
+        thumbnails.append(
+            [
+                generate_thumbnail_with_text(post, resolution, subreddit_image)
+                for resolution in resolutions
+            ]
+        )
+    return thumbnails
@@ -1,3 +1,4 @@
+import argparse
 from enum import Enum
 import json
 import datetime
@@ -5,18 +6,35 @@ import os
 from random import randrange
 import sys
 from typing import Literal, Tuple
-from moviepy import CompositeVideoClip, TextClip, VideoClip
+from moviepy import CompositeAudioClip, CompositeVideoClip, TextClip, VideoClip
 from configuration import Configuration
 from openai_interface import OpenAiInterface
 from reddit_requests import Post, PostSearch, create_post_from_post_id
-from comment_based_video import find_comment_post, generate_comments_clip
-from story_based_video import find_story_post, generate_story_clip
-from thumbnail_with_text import generate_thumbnail_with_text
+from comment_based_video import (
+    find_comment_post,
+    generate_comment_narration,
+    generate_comments_clip,
+)
+from story_based_video import (
+    find_story_post,
+    generate_story_clip,
+    generate_story_narration,
+)
+from thumbnail_with_text import generate_thumbnails_with_text
+from render_timeline import Timeline
+from instrumentation import span, write_report
+from posted_registry import posted_registry
+from ffmpeg_renderer import render_timelines_with_ffmpeg
+from caption_compositor import CaptionTrack, composite_captions
+from parallel_renderer import render_timeline_in_parallel
 from video_utils import (
+    BackgroundSelection,
     check_if_valid_post,
     crop_to_center_and_resize,
     is_between_durations,
-    select_background_video,
+    load_background_clip,
+    select_background_file,
+    write_atomically,
 )
 
 config = Configuration()
@@ -25,29 +43,20 @@ with open("config/reddit_threads.json") as file:
     reddit_threads = json.loads(file.read())
 
 
-def get_already_posted_ids():
-    with open("config/already_posted.txt", "r") as file:
-        already_posted_ids = file.read().splitlines()
-        return already_posted_ids
-
-
-def add_to_already_posted_ids(new_id: str):
-    already_posted_ids = get_already_posted_ids()
-    already_posted_ids.append(new_id)
-    with open("config/already_posted.txt", "w") as file:
-        for id in already_posted_ids:
-            file.write(id + "\n")
-
-
 def generate_story_video(
     resolution: Tuple[int, int],
     timeframe: Literal["day", "week", "month", "year", "all"],
     listing: Literal["controversial", "best", "hot", "new", "random", "rising", "top"],
     approx_video_duration: datetime.timedelta = datetime.timedelta(minutes=5),
 ):
-    selected_post = find_story_post(
-        timeframe, listing, reddit_threads["story_based"], approx_video_duration
-    )
+    # another process may have picked the same post in the meantime
+    while True:
+        selected_post = find_story_post(
+            timeframe, listing, reddit_threads["story_based"], approx_video_duration
+        )
+        if posted_registry.claim(selected_post.post_id):
+            break
+        print(f"post {selected_post.post_id} was taken by another process")
     generate_story_video_by_id(selected_post.post_id, resolution)
 
 
@@ -57,10 +66,18 @@ def generate_comment_video(
     listing: Literal["controversial", "best", "hot", "new", "random", "rising", "top"],
     approx_video_duration: datetime.timedelta = datetime.timedelta(minutes=5),
 ):
-    selected_post = find_comment_post(
-        timeframe, listing, reddit_threads["comment_based"], approx_video_duration
+    while True:
+        selected_post = find_comment_post(
+            timeframe, listing, reddit_threads["comment_based"], approx_video_duration
+        )
+        if posted_registry.claim(selected_post.post_id):
+            break
+        print(f"post {selected_post.post_id} was taken by another process")
+    generate_comment_video_by_id(
+        selected_post.post_id,
+        resolution,
+        approx_video_duration=approx_video_duration,
     )
-    generate_comment_video_by_id(selected_post.post_id, resolution)
 
 
 def generate_story_video_by_id(
@@ -69,35 +86,48 @@ def generate_story_video_by_id(
     generate_intro: bool = True,
     generate_outro: bool = True,
 ):
-    post = create_post_from_post_id(post_id)
-    add_to_already_posted_ids(post.post_id)
-    print(f'selected post titled "{post.title}"')
-    print(f"saving post_id {post.post_id} as selected")
-
-    video: VideoClip = generate_story_clip(
-        post, resolution, "english", add_intro=generate_intro, add_outro=generate_outro
-    )
+    generate_story_videos_by_id(post_id, [resolution], generate_intro, generate_outro)
 
-    background_video: VideoClip
-    background_video_credit: str
-    background_video, background_video_credit = select_background_video(video.duration)
-    background_video = crop_to_center_and_resize(background_video, resolution)
-    video = CompositeVideoClip([background_video, video])
 
-    if not os.path.exists(config.output_dir + post.post_id):
-        os.mkdir(config.output_dir + post.post_id)
-
-    save_video(video, post)
-
-    generate_and_save_description_and_tags(post, background_video_credit, "story")
-    generate_and_save_title(post)
-
-    thumbnail = generate_thumbnail_with_text(post, resolution)
-    thumbnail.save(f"{config.output_dir + post.post_id}/thumbnail.jpg")
-
-    for f in os.listdir("tmp/"):
-        if f.startswith(f"{post.post_id}"):
-            os.remove(f"tmp/{f}")
+def generate_story_videos_by_id(
+    post_id: str,
+    resolutions: list[Tuple[int, int]],
+    generate_intro: bool = True,
+    generate_outro: bool = True,
+):
+    with span("story_video") as root:
+        with span("reddit_fetch"):
+            post = create_post_from_post_id(post_id)
+        posted_registry.claim(post.post_id)
+        print(f'selected post titled "{post.title}"')
+        print(f"saving post_id {post.post_id} as selected")
+
+        # speech and alignment are created once for every resolution
+        with span("narration"):
+            narration = generate_story_narration(
+                post, "english", generate_intro, generate_outro
+            )
+
+        videos: list[VideoClip] = []
+        timelines: list[Timeline] = []
+        for resolution in resolutions:
+            timeline = Timeline(resolution)
+            with span("story_clip"):
+                videos.append(
+                    generate_story_clip(post, resolution, narration, timeline)
+                )
+            timelines.append(timeline)
+
+        finish_videos(post, videos, timelines, "story")
+
+    write_report(
+        root,
+        config.output_dir + post.post_id + "/report.json",
+        post_id=post.post_id,
+        type_of_video="story",
+        resolutions=resolutions,
+        duration=videos[0].duration,
+    )
 
 
 def generate_comment_video_by_id(
@@ -105,36 +135,104 @@ def generate_comment_video_by_id(
     resolution: Tuple[int, int],
     generate_intro: bool = True,
     generate_outro: bool = True,
+    approx_video_duration: datetime.timedelta | None = None,
 ):
-    post = create_post_from_post_id(post_id)
-    add_to_already_posted_ids(post.post_id)
-    print(f'selected post titled "{post.title}"')
-    print(f"saving post_id {post.post_id} as selected")
+    generate_comment_videos_by_id(
+        post_id, [resolution], generate_intro, generate_outro, approx_video_duration
+    )
+
 
-    video: VideoClip = generate_comments_clip(
-        post, resolution, generate_intro, generate_outro
+def generate_comment_videos_by_id(
+    post_id: str,
+    resolutions: list[Tuple[int, int]],
+    generate_intro: bool = True,
+    generate_outro: bool = True,
+    approx_video_duration: datetime.timedelta | None = None,
+):
+    with span("comment_video") as root:
+        with span("reddit_fetch"):
+            post = create_post_from_post_id(post_id)
+        posted_registry.claim(post.post_id)
+        print(f'selected post titled "{post.title}"')
+        print(f"saving post_id {post.post_id} as selected")
+
+        # the comments and their speech are fetched once for every resolution
+        with span("narration"):
+            narration = generate_comment_narration(
+                post, generate_intro, generate_outro, approx_video_duration
+            )
+
+        videos: list[VideoClip] = []
+        timelines: list[Timeline] = []
+        for resolution in resolutions:
+            timeline = Timeline(resolution)
+            with span("comment_clip"):
+                videos.append(
+                    generate_comments_clip(post, resolution, narration, timeline)
+                )
+            timelines.append(timeline)
+
+        finish_videos(post, videos, timelines, "comment")
+
+    write_report(
+        root,
+        config.output_dir + post.post_id + "/report.json",
+        post_id=post.post_id,
+        type_of_video="comment",
+        resolutions=resolutions,
+        duration=videos[0].duration,
     )
 
-    background_video: VideoClip
-    background_video_credit: str
-    background_video, background_video_credit = select_background_video(video.duration)
-    background_video = crop_to_center_and_resize(background_video, resolution)
-    video = CompositeVideoClip([background_video, video])
+
+def output_filename(
+    post: Post, name: str, resolution: Tuple[int, int], num_resolutions: int
+) -> str:
+    base, ext = name.split(".")
+    if num_resolutions > 1:
+        base = f"{base}-{resolution[0]}x{resolution[1]}"
+    return f"{config.output_dir + post.post_id}/{base}.{ext}"
+
+
+def finish_videos(
+    post: Post,
+    videos: list[VideoClip],
+    timelines: list[Timeline],
+    type_of_video: Literal["comment", "story"],
+):
+    # every resolution shares the same background window. proxies only exist
+    # per resolution, so they are only used when there is a single one
+    resolutions = [timeline.resolution for timeline in timelines]
+    with span("background_selection"):
+        background = select_background_file(
+            max(video.duration for video in videos),
+            resolutions[0] if len(resolutions) == 1 else None,
+        )
 
     if not os.path.exists(config.output_dir + post.post_id):
         os.mkdir(config.output_dir + post.post_id)
 
-    save_video(video, post)
-
-    generate_and_save_description_and_tags(post, background_video_credit, "comment")
-    generate_and_save_title(post)
-    thumbnail = generate_thumbnail_with_text(post, resolution)
-    thumbnail.save(f"{config.output_dir + post.post_id}/thumbnail.jpg")
+    filenames = [
+        output_filename(post, "video.mp4", resolution, len(resolutions))
+        for resolution in resolutions
+    ]
+    with span("render"):
+        render_videos(videos, background, timelines, post, filenames)
+
+    with span("description"):
+        generate_and_save_description_and_tags(post, background.credit, type_of_video)
+    with span("title"):
+        generate_and_save_title(post)
+
+    with span("thumbnail"):
+        thumbnails = generate_thumbnails_with_text([post], resolutions)[0]
+        for resolution, thumbnail in zip(resolutions, thumbnails):
+            thumbnail.save(
+                output_filename(post, "thumbnail.jpg", resolution, len(resolutions))
+            )
 
     for f in os.listdir("tmp/"):
         if f.startswith(f"{post.post_id}"):
             os.remove(f"tmp/{f}")
-            pass
 
 
 def generate_and_save_title(post: Post):
@@ -184,9 +282,70 @@ def generate_and_save_description_and_tags(
         file.write(description)
 
 
-def save_video(video: VideoClip, post: Post):
+def render_videos(
+    videos: list[VideoClip],
+    background: BackgroundSelection,
+    timelines: list[Timeline],
+    post: Post,
+    filenames: list[str],
+):
+    if config.render_backend in ["ffmpeg", "parallel"]:
+        narration_audio = f"tmp/{post.post_id}-narration.wav"
+        write_atomically(
+            narration_audio,
+            lambda f: videos[0].audio.write_audiofile(f),  # type: ignore
+        )
+        for video, timeline in zip(videos, timelines):
+            timeline.background = background
+            timeline.duration = video.duration
+            timeline.narration_audio = narration_audio
+
+    if config.render_backend == "ffmpeg":
+        # a single ffmpeg process decodes the background once for all outputs
+        render_timelines_with_ffmpeg(timelines, filenames, f"tmp/{post.post_id}")
+        return
+
+    for video, timeline, filename in zip(videos, timelines, filenames):
+        render_video(video, background, timeline, post, filename)
+
+
+def render_video(
+    video: VideoClip,
+    background: BackgroundSelection,
+    timeline: Timeline,
+    post: Post,
+    filename: str,
+):
+    # the ffmpeg backend renders every resolution at once in render_videos
+    width, height = timeline.resolution
+    if config.render_backend == "parallel":
+        render_timeline_in_parallel(
+            timeline, filename, f"tmp/{post.post_id}-{width}x{height}"
+        )
+    elif config.render_backend == "compositor":
+        background_video = load_background_clip(background)
+        background_video = crop_to_center_and_resize(
+            background_video, timeline.resolution
+        )
+        track = CaptionTrack(timeline.captions, timeline.resolution)
+        combined = composite_captions(background_video, track)
+
+        audio_clips = [
+            clip.audio for clip in [background_video, video] if clip.audio != None
+        ]
+        combined = combined.with_audio(CompositeAudioClip(audio_clips))
+        save_video(combined, filename)
+    else:
+        background_video = load_background_clip(background)
+        background_video = crop_to_center_and_resize(
+            background_video, timeline.resolution
+        )
+        save_video(CompositeVideoClip([background_video, video]), filename)
+
+
+def save_video(video: VideoClip, filename: str):
     video.write_videofile(
-        config.output_dir + post.post_id + "/video.mp4",
+        filename,
         fps=config.video_fps,
         threads=config.num_threads,
         preset=config.write_video_preset,
@@ -236,11 +395,36 @@ def save_video(video: VideoClip, post: Post):
 
     
 #     try:
-#         generate_story_video_by_id(
-#             # post.post_id, (1080, 1920), generate_intro=False, generate_outro=False
-#             post.post_id, (1920, 1080), generate_intro=True, generate_outro=True,
+#         generate_story_videos_by_id(
+#             post.post_id, [(1920, 1080), (1080, 1920)], generate_intro=True, generate_outro=True,
 #         )
 #     except Exception as e:
 #         print(e)
 #         pass
 
+
+if __name__ == "__main__":
+    # anything that renders has to stay under this guard. On Windows the
+    # parallel render backend starts worker processes that import the main
+    # module again, code outside of it would run once more in every worker
+    parser = argparse.ArgumentParser(description="generate videos from reddit posts")
+    parser.add_argument("type_of_video", choices=["story", "comment"])
+    parser.add_argument("post_ids", nargs="+")
+    parser.add_argument(
+        "--resolution",
+        action="append",
+        help="WIDTHxHEIGHT, can be given more than once, 1920x1080 by default",
+    )
+    args = parser.parse_args()
+
+    resolutions: list[Tuple[int, int]] = [
+        (int(width), int(height))
+        for width, height in [
+            resolution.split("x") for resolution in args.resolution or ["1920x1080"]
+        ]
+    ]
+    for post_id in args.post_ids:
+        if args.type_of_video == "story":
+            generate_story_videos_by_id(post_id, resolutions)
+        else:
+            generate_comment_videos_by_id(post_id, resolutions)
@@ -1,57 +1,89 @@
 from datetime import timedelta
 from math import floor
+import os
 from pathlib import Path
 from random import randint, randrange
 import random
 from moviepy.video.fx import resize, crop
 from moviepy.audio.fx import multiply_volume
 from moviepy import *
-from typing import Tuple
+from typing import Callable, Tuple
+from background_library import (
+    POSSIBLE_FILE_ENDINGS,
+    choose_start_time,
+    get_background_library,
+    has_up_to_date_proxy,
+    proxy_filename,
+)
+from caption_cache import caption_clip
 from configuration import Configuration
+from posted_registry import posted_registry
+from instrumentation import span
 from openai_interface import OpenAiInterface
 
 from reddit_requests import Post
 
 config = Configuration()
 
-POSSIBLE_FILE_ENDINGS = (".mp4", ".webm", ".mkv", ".ogv", ".mpeg", ".avi", ".mov")
-
 CHARS_PER_SECOND = (10000 / 10.5) / 60
 
 
-def select_background_video(min_length: int) -> Tuple[VideoClip, str]:
-    possible_videos = [
-        p.resolve()
-        for p in Path(config.background_videos_dir).glob("**/*")
-        if p.suffix in POSSIBLE_FILE_ENDINGS
-    ]
-
-    clip: VideoClip | None = None
-    background_video_credit: str | None = None
-
-    random.shuffle(possible_videos)
-    for video in possible_videos:
-        clip = VideoFileClip(video)
-        if min_length <= clip.duration:
-            selected_file = video
-            background_video_credit = str(selected_file).split("\\")[-2]
-            print(f"selected {selected_file} as background video")
-            start_time = random.random() * (clip.duration - min_length)
-            end_time = start_time + min_length
-            print(
-                f"using background video time between {start_time:.2f}s and {end_time:.2f}s out of {clip.duration:.2f}s"
-            )
-            clip = clip.subclip(start_time, end_time)
-            clip = clip.afx(multiply_volume, config.background_video_volume)  # type: ignore
-            break
-
-    if clip == None or background_video_credit == None:
+class BackgroundSelection:
+    def __init__(
+        self,
+        filename: str,
+        credit: str,
+        start_time: float,
+        end_time: float,
+        has_audio: bool,
+    ) -> None:
+        self.filename = filename
+        self.credit = credit
+        self.start_time = start_time
+        self.end_time = end_time
+        self.has_audio = has_audio
+
+
+def select_background_file(
+    min_length: float, resolution: Tuple[int, int] | None = None
+) -> BackgroundSelection:
+    video = get_background_library().choose(min_length)
+    if video == None:
         raise Exception(f"No suitable background video found for duration {min_length}")
 
-    return (clip, background_video_credit)
+    filename = video.filename
+    use_proxy = resolution != None and has_up_to_date_proxy(video, resolution)
+    if use_proxy:
+        filename = proxy_filename(video, resolution)  # type: ignore
+
+    print(f"selected {filename} as background video")
+    start_time = choose_start_time(video, min_length, use_proxy)
+    end_time = start_time + min_length
+    print(
+        f"using background video time between {start_time:.2f}s and {end_time:.2f}s out of {video.duration:.2f}s"
+    )
+    return BackgroundSelection(
+        filename, video.credit, start_time, end_time, video.has_audio
+    )
+
+
+def load_background_clip(selection: BackgroundSelection) -> VideoClip:
+    clip = VideoFileClip(selection.filename)
+    clip = clip.subclip(selection.start_time, selection.end_time)
+    if selection.has_audio:
+        clip = clip.afx(multiply_volume, config.background_video_volume)  # type: ignore
+    return clip
+
+
+def select_background_video(min_length: float) -> Tuple[VideoClip, str]:
+    selection = select_background_file(min_length)
+    return (load_background_clip(selection), selection.credit)
 
 
 def crop_to_center_and_resize(clip: VideoClip, to_resolution: Tuple[int, int]):
+    if tuple(clip.size) == tuple(to_resolution):
+        return clip
+
     new_aspect_ratio: float = to_resolution[0] / to_resolution[1]
     x1 = (clip.size[0] - (clip.size[1] * new_aspect_ratio)) // 2
     x2 = (clip.size[0] + (clip.size[1] * new_aspect_ratio)) // 2
@@ -63,26 +95,48 @@ def crop_to_center_and_resize(clip: VideoClip, to_resolution: Tuple[int, int]):
     return clip
 
 
-def generate_intro_clip(post: Post, resolution: Tuple[int, int]) -> VideoClip:
-    openaiinterface = OpenAiInterface()
-    intro_text = openaiinterface.generate_text_without_context(
-        config.intro_prompt,
-        post.title + "\n" + post.selftext,
-    )
-    openaiinterface.generate_mp3(intro_text, f"tmp/{post.post_id}-audio-intro.mp3")
+def write_atomically(filename: str, write: Callable[[str], None]):
+    """Lets write create the file under a temporary name and only then moves
+    it to filename, so a file that exists is always complete."""
+    base, ext = os.path.splitext(filename)
+    tmp_file = f"{base}.tmp{ext}"
+    write(tmp_file)
+    os.replace(tmp_file, filename)
+
+
+def generate_intro_audio(post: Post) -> str:
+    filename = f"tmp/{post.post_id}-audio-intro.mp3"
+    with span("intro"):
+        openaiinterface = OpenAiInterface()
+        intro_text = openaiinterface.generate_text_without_context(
+            config.intro_prompt,
+            post.title + "\n" + post.selftext,
+        )
+        openaiinterface.generate_mp3(intro_text, filename)
+    return filename
+
+
+def generate_outro_audio(post: Post) -> str:
+    filename = f"tmp/{post.post_id}-audio-outro.mp3"
+    with span("outro"):
+        openaiinterface = OpenAiInterface()
+        outro_text = openaiinterface.generate_text_without_context(
+            config.outro_prompt,
+            post.title + "\n" + post.selftext,
+        )
+        openaiinterface.generate_mp3(outro_text, filename)
+    return filename
 
-    intro_clip: VideoClip = TextClip(
+
+def generate_intro_clip(
+    post: Post, resolution: Tuple[int, int], audio_file: str
+) -> VideoClip:
+    intro_clip: VideoClip = caption_clip(
         config.intro_header + "\n" + post.title,
-        size=(resolution[0] * 0.8, 0),
-        color=config.video_font_color,
-        font=config.video_font,
-        font_size=config.video_font_size,
-        method="caption",
-        stroke_color=config.video_font_stroke_color,
-        stroke_width=config.video_font_stroke_width,
-        align="center",
+        config.video_font_size,
+        resolution[0] * 0.8,
     )
-    audio_clip = AudioFileClip(f"tmp/{post.post_id}-audio-intro.mp3")
+    audio_clip = AudioFileClip(audio_file)
     intro_clip = intro_clip.with_duration(audio_clip.duration + 1)
     intro_clip = intro_clip.with_audio(audio_clip)
 
@@ -91,16 +145,9 @@ def generate_intro_clip(post: Post, resolution: Tuple[int, int]) -> VideoClip:
     return intro_clip
 
 
-def generate_outro_clip(post: Post, resolution: Tuple[int, int]) -> VideoClip:
-    openaiinterface = OpenAiInterface()
-    outro_text = openaiinterface.generate_text_without_context(
-        config.outro_prompt,
-        post.title + "\n" + post.selftext,
-    )
-    openaiinterface.generate_mp3(outro_text, f"tmp/{post.post_id}-audio-outro.mp3")
-
+def generate_outro_clip(audio_file: str) -> VideoClip:
     outro_clip: VideoClip = TextClip(" ")
-    audio_clip = AudioFileClip(f"tmp/{post.post_id}-audio-outro.mp3")
+    audio_clip = AudioFileClip(audio_file)
     outro_clip = outro_clip.with_duration(audio_clip.duration + 1)
     outro_clip = outro_clip.with_audio(audio_clip)
 
@@ -117,22 +164,14 @@ def check_if_valid_post(
     min_duration: timedelta | None = None,
     max_duration: timedelta | None = None
 ) -> bool:
-    with open("config/already_posted.txt", "r") as file:
-        already_posted_ids = file.read().splitlines()
-    if post_id in already_posted_ids:
+    if post_id in posted_registry:
         print(f"Post {post_id} has already been posted")
         return False
     
     if nsfw:
         return False
 
-    filter_word_in_title = ["update:", "(update)", "[update]"]
-    for word in filter_word_in_title:
-        if word in post_title.lower():
-            print(f"Post {post_id} is an update")
-            return False
-
-    if post_title.lower().startswith("update"):
+    if is_update_title(post_title):
         print(f"Post {post_id} is an update")
         return False
 
@@ -157,6 +196,35 @@ def check_if_valid_post(
     return True
 
 
+def is_update_title(title: str) -> bool:
+    filter_word_in_title = ["update:", "(update)", "[update]"]
+    for word in filter_word_in_title:
+        if word in title.lower():
+            return True
+    return title.lower().startswith("update")
+
+
+def duration_bounds(
+    approx_duration: timedelta | None = None,
+    min_duration: timedelta | None = None,
+    max_duration: timedelta | None = None,
+) -> Tuple[timedelta | None, timedelta | None]:
+    """Shortest and longest duration that passes all of the given checks."""
+    lower_bounds = [] if min_duration == None else [min_duration]
+    upper_bounds = [] if max_duration == None else [max_duration]
+    if approx_duration != None:
+        lower_bounds.append(
+            approx_duration - (approx_duration * config.tolerated_duration_offset)
+        )
+        upper_bounds.append(
+            approx_duration + (approx_duration * config.tolerated_duration_offset)
+        )
+    return (
+        max(lower_bounds) if len(lower_bounds) > 0 else None,
+        min(upper_bounds) if len(upper_bounds) > 0 else None,
+    )
+
+
 def is_max_duration(text: str, max_duration: timedelta) -> bool:
     text_duration = len(text) / CHARS_PER_SECOND
     if max_duration.total_seconds() < text_duration: